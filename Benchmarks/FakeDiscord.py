@@ -0,0 +1,361 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict, Counter
+from datetime import datetime, timezone
+
+from aiohttp import web, WSMsgType
+
+DISCORD_EPOCH = 1420070400000
+API_PREFIX = "/api/v7"
+
+# (requests, seconds) per bucket, roughly what discord gives bots, anything not listed only counts for the global limit
+RATE_LIMITS = {
+    "POST /channels/{channel}/messages": (5, 5),
+    "PATCH /channels/{channel}/messages/{id}": (5, 5),
+    "DELETE /channels/{channel}/messages/{id}/reactions/{id}/{id}": (1, 0.25),
+    "PUT /channels/{channel}/messages/{id}/reactions/{id}/@me": (1, 0.25),
+    "PATCH /guilds/{guild}/roles/{id}": (2, 10),
+    "POST /users/@me/channels": (10, 1),
+}
+GLOBAL_LIMIT = (50, 1)
+
+
+class Bucket:
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset = time.monotonic() + per
+
+    def take(self):
+        # returns how long to wait if the bucket is exhausted, None if the request can go through
+        now = time.monotonic()
+        if now >= self.reset:
+            self.remaining = self.limit
+            self.reset = now + self.per
+        if self.remaining == 0:
+            return self.reset - now
+        self.remaining -= 1
+        return None
+
+    def headers(self):
+        reset_after = max(0.0, self.reset - time.monotonic())
+        return {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(time.time() + reset_after),
+            "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+        }
+
+
+def json_response(data, status=200, headers=None):
+    # discord.py only decodes bodies sent as exactly application/json, aiohttp's json_response adds a charset
+    headers = dict(headers or {})
+    headers["Content-Type"] = "application/json"
+    return web.Response(body=json.dumps(data).encode(), status=status, headers=headers)
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+# a local stand-in for the parts of discord's gateway and rest api the bot uses, with everything it does recorded
+class FakeDiscord:
+    def __init__(self, rate_limits=True):
+        self.counter = itertools.count()
+        self.rate_limits = rate_limits
+        self.buckets = dict()
+        self.global_bucket = Bucket(*GLOBAL_LIMIT)
+        self.sockets = list()
+        self.sequence = itertools.count(1)
+        self.runner = None
+        self.port = None
+
+        self.bot_user = self.user_data(self.snowflake(), "GameDjinnie", bot=True)
+        self.users = dict()
+        self.channels = dict()
+        self.messages = dict()
+        self.roles = dict()
+        self.guild_id = self.snowflake()
+        self.roles[self.guild_id] = self.role_data(self.guild_id, "@everyone", permissions=8)
+        self.members = dict()
+
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        self.uploads = list()
+        # user id -> list of (timestamp, content) for every DM the bot sent them
+        self.dms = defaultdict(list)
+        self.dm_waiters = defaultdict(list)
+        self.ready = asyncio.Event()
+
+    def snowflake(self):
+        return ((int(time.time() * 1000) - DISCORD_EPOCH) << 22) | (next(self.counter) % 4096)
+
+    @staticmethod
+    def user_data(user_id, name, bot=False):
+        return {"id": str(user_id), "username": name, "discriminator": f"{user_id % 10000:04}", "avatar": None,
+                "bot": bot}
+
+    @staticmethod
+    def role_data(role_id, name, permissions=0):
+        return {"id": str(role_id), "name": name, "permissions": permissions, "position": 0, "color": 0,
+                "hoist": False, "managed": False, "mentionable": False}
+
+    def add_user(self, user_id, name=None, roles=()):
+        self.users[user_id] = self.user_data(user_id, name or f"tester{user_id % 100000}")
+        self.members[user_id] = {"user": self.users[user_id], "roles": [str(r) for r in roles],
+                                 "joined_at": now_iso(), "deaf": False, "mute": False}
+        return self.users[user_id]
+
+    def add_role(self, name):
+        role_id = self.snowflake()
+        self.roles[role_id] = self.role_data(role_id, name)
+        return role_id
+
+    def add_channel(self, name):
+        channel_id = self.snowflake()
+        self.channels[channel_id] = {"id": str(channel_id), "type": 0, "guild_id": str(self.guild_id), "name": name,
+                                     "position": len(self.channels), "permission_overwrites": [], "nsfw": False,
+                                     "topic": None, "parent_id": None, "last_message_id": None,
+                                     "rate_limit_per_user": 0}
+        return channel_id
+
+    def add_message(self, channel_id, content, author=None):
+        message_id = self.snowflake()
+        self.messages[message_id] = {"id": str(message_id), "channel_id": str(channel_id), "content": content,
+                                     "author": author or self.bot_user, "attachments": [], "embeds": [],
+                                     "mentions": [], "mention_roles": [], "mention_everyone": False, "pinned": False,
+                                     "tts": False, "type": 0, "timestamp": now_iso(), "edited_timestamp": None,
+                                     "flags": 0}
+        if "guild_id" in self.channels[channel_id]:
+            self.messages[message_id]["guild_id"] = self.channels[channel_id]["guild_id"]
+        return message_id
+
+    def guild_data(self):
+        return {"id": str(self.guild_id), "name": "Testers", "unavailable": False, "owner_id": self.bot_user["id"],
+                "region": "europe", "icon": None, "splash": None, "afk_timeout": 300, "verification_level": 0,
+                "explicit_content_filter": 0, "default_message_notifications": 0, "mfa_level": 0, "features": [],
+                "emojis": [], "roles": list(self.roles.values()),
+                "channels": [c for c in self.channels.values() if c["type"] == 0],
+                "members": [{"user": self.bot_user, "roles": [], "joined_at": now_iso(), "deaf": False,
+                             "mute": False}] + list(self.members.values()),
+                "member_count": len(self.members) + 1, "large": False, "voice_states": [], "presences": [],
+                "premium_tier": 0, "system_channel_id": None, "joined_at": now_iso()}
+
+    async def gateway(self, request):
+        socket = web.WebSocketResponse(max_msg_size=0)
+        await socket.prepare(request)
+        self.sockets.append(socket)
+        await socket.send_str(json.dumps({"op": 10, "d": {"heartbeat_interval": 41250}, "s": None, "t": None}))
+        async for message in socket:
+            if message.type != WSMsgType.TEXT:
+                continue
+            data = json.loads(message.data)
+            if data["op"] == 1:
+                await socket.send_str(json.dumps({"op": 11, "d": None, "s": None, "t": None}))
+            elif data["op"] == 2:
+                await self.send_event(socket, "READY", {
+                    "v": 6, "user": self.bot_user, "session_id": "fake-session", "private_channels": [],
+                    "relationships": [], "guilds": [{"id": str(self.guild_id), "unavailable": True}]})
+                await self.send_event(socket, "GUILD_CREATE", self.guild_data())
+                self.ready.set()
+        self.sockets.remove(socket)
+        return socket
+
+    async def send_event(self, socket, event, data):
+        await socket.send_str(json.dumps({"op": 0, "t": event, "s": next(self.sequence), "d": data}))
+
+    async def dispatch(self, event, data):
+        for socket in self.sockets:
+            await self.send_event(socket, event, data)
+
+    async def add_reaction(self, user_id, channel_id, message_id, emoji):
+        await self.dispatch("MESSAGE_REACTION_ADD", {
+            "user_id": str(user_id), "channel_id": str(channel_id), "message_id": str(message_id),
+            "guild_id": str(self.guild_id), "emoji": {"id": None, "name": emoji}, "member": self.members[user_id]})
+
+    async def send_command(self, author_id, channel_id, content):
+        message_id = self.add_message(channel_id, content, self.users[author_id])
+        data = dict(self.messages[message_id])
+        data["member"] = {k: v for k, v in self.members[author_id].items() if k != "user"}
+        await self.dispatch("MESSAGE_CREATE", data)
+
+    @staticmethod
+    def bucket_key(request):
+        # the bucket this request counts against (the major parameter gets its own, like discord does) and its route
+        parts = request.path[len(API_PREFIX):].strip("/").split("/")
+        bucket = list()
+        route = list()
+        for i, part in enumerate(parts):
+            previous = parts[i - 1] if i > 0 else None
+            if previous in ("channels", "guilds") and part.isnumeric():
+                bucket.append(part)
+                route.append("{channel}" if previous == "channels" else "{guild}")
+            elif part.isnumeric() or previous == "reactions":
+                bucket.append("{id}")
+                route.append("{id}")
+            else:
+                bucket.append(part)
+                route.append(part)
+        return f"{request.method} /{'/'.join(bucket)}", f"{request.method} /{'/'.join(route)}"
+
+    def limit(self, request):
+        key, route = self.bucket_key(request)
+        self.calls[route] += 1
+        if not self.rate_limits:
+            return None, {}
+        retry = self.global_bucket.take()
+        if retry is not None:
+            self.rate_limited[route] += 1
+            return self.too_many(retry, True), {}
+        if route not in RATE_LIMITS:
+            return None, {}
+        if key not in self.buckets:
+            self.buckets[key] = Bucket(*RATE_LIMITS[route])
+        bucket = self.buckets[key]
+        retry = bucket.take()
+        if retry is not None:
+            self.rate_limited[route] += 1
+            return self.too_many(retry, False, bucket.headers()), {}
+        return None, bucket.headers()
+
+    @staticmethod
+    def too_many(retry, is_global, headers=None):
+        headers = dict(headers or {})
+        if is_global:
+            headers["X-RateLimit-Global"] = "true"
+        headers["Retry-After"] = str(int(retry * 1000))
+        # v7 of the api still reports retry_after in milliseconds
+        return json_response({"message": "You are being rate limited.", "retry_after": int(retry * 1000) + 1,
+                              "global": is_global}, status=429, headers=headers)
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        if request.path.startswith(f"{API_PREFIX}/gateway"):
+            return await handler(request)
+        limited, headers = self.limit(request)
+        if limited is not None:
+            return limited
+        response = await handler(request)
+        response.headers.update(headers)
+        return response
+
+    @staticmethod
+    def not_found(message="Unknown Message", code=10008):
+        return json_response({"message": message, "code": code}, status=404)
+
+    async def get_gateway(self, request):
+        return json_response({"url": f"ws://127.0.0.1:{self.port}{API_PREFIX}/gateway/ws", "shards": 1,
+                              "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0}})
+
+    async def get_me(self, request):
+        return json_response(self.bot_user)
+
+    async def get_user(self, request):
+        user = self.users.get(int(request.match_info["user"]))
+        if user is None:
+            return self.not_found("Unknown User", 10013)
+        return json_response(user)
+
+    async def create_dm(self, request):
+        data = await request.json()
+        recipient = int(data["recipient_id"])
+        for channel in self.channels.values():
+            if channel["type"] == 1 and channel["recipients"][0]["id"] == str(recipient):
+                return json_response(channel)
+        channel_id = self.snowflake()
+        self.channels[channel_id] = {"id": str(channel_id), "type": 1, "last_message_id": None,
+                                     "recipients": [self.users.get(recipient, self.user_data(recipient, "unknown"))]}
+        return json_response(self.channels[channel_id])
+
+    async def send_message(self, request):
+        channel_id = int(request.match_info["channel"])
+        if channel_id not in self.channels:
+            return self.not_found("Unknown Channel", 10003)
+        files = list()
+        if request.content_type.startswith("multipart/"):
+            form = await request.post()
+            payload = json.loads(form.get("payload_json", "{}"))
+            for field in form.values():
+                if hasattr(field, "filename"):
+                    files.append({"filename": field.filename, "size": len(field.file.read())})
+        else:
+            payload = await request.json()
+        message_id = self.add_message(channel_id, payload.get("content") or "")
+        message = self.messages[message_id]
+        message["embeds"] = [payload["embed"]] if payload.get("embed") else []
+        message["attachments"] = [{"id": str(self.snowflake()), "filename": f["filename"], "size": f["size"],
+                                   "url": f"http://127.0.0.1:{self.port}/attachments/{f['filename']}",
+                                   "proxy_url": "", "height": None, "width": None} for f in files]
+        self.uploads += files
+        channel = self.channels[channel_id]
+        if channel["type"] == 1:
+            user_id = int(channel["recipients"][0]["id"])
+            self.dms[user_id].append((time.perf_counter(), message["content"]))
+            for waiter in self.dm_waiters.pop(user_id, []):
+                if not waiter.done():
+                    waiter.set_result(None)
+        return json_response(message)
+
+    async def get_message(self, request):
+        message = self.messages.get(int(request.match_info["message"]))
+        if message is None or message["channel_id"] != request.match_info["channel"]:
+            return self.not_found()
+        return json_response(message)
+
+    async def edit_message(self, request):
+        message = self.messages.get(int(request.match_info["message"]))
+        if message is None:
+            return self.not_found()
+        payload = await request.json()
+        if "content" in payload:
+            message["content"] = payload["content"]
+        message["edited_timestamp"] = now_iso()
+        return json_response(message)
+
+    async def reaction(self, request):
+        if int(request.match_info["message"]) not in self.messages:
+            return self.not_found()
+        return web.Response(status=204)
+
+    async def edit_role(self, request):
+        role = self.roles.get(int(request.match_info["role"]))
+        if role is None:
+            return self.not_found("Unknown Role", 10011)
+        role.update(await request.json())
+        return json_response(role)
+
+    async def start(self):
+        app = web.Application(middlewares=[self.middleware], client_max_size=100 * 1024 * 1024)
+        app.router.add_get(f"{API_PREFIX}/gateway", self.get_gateway)
+        app.router.add_get(f"{API_PREFIX}/gateway/bot", self.get_gateway)
+        app.router.add_get(f"{API_PREFIX}/gateway/ws", self.gateway)
+        app.router.add_get(f"{API_PREFIX}/users/@me", self.get_me)
+        app.router.add_post(f"{API_PREFIX}/users/@me/channels", self.create_dm)
+        app.router.add_get(API_PREFIX + "/users/{user}", self.get_user)
+        app.router.add_post(API_PREFIX + "/channels/{channel}/messages", self.send_message)
+        app.router.add_get(API_PREFIX + "/channels/{channel}/messages/{message}", self.get_message)
+        app.router.add_patch(API_PREFIX + "/channels/{channel}/messages/{message}", self.edit_message)
+        app.router.add_route("*", API_PREFIX + "/channels/{channel}/messages/{message}/reactions/{emoji}/{user}",
+                             self.reaction)
+        app.router.add_patch(API_PREFIX + "/guilds/{guild}/roles/{role}", self.edit_role)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}{API_PREFIX}"
+
+    async def wait_for_dm(self, user_id, timeout):
+        if len(self.dms[user_id]) > 0:
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self.dm_waiters[user_id].append(waiter)
+        await asyncio.wait_for(waiter, timeout)
+
+    async def stop(self):
+        for socket in list(self.sockets):
+            await socket.close()
+        await self.runner.cleanup()
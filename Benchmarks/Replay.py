@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import discord
+import yaml
+from tortoise import Tortoise
+
+from Benchmarks.FakeDiscord import FakeDiscord
+from Benchmarks.Suite import percentile
+from GameDjinnie import GameJinnie
+from Utils import Configuration, Database, Migrations
+from Utils.Models import Game, NewGameTest
+
+REACTION = "😛"
+
+
+def synthetic_traffic(reactions, spread, repeat_ratio, first_user):
+    # everyone reacts once somewhere in the spread, some of them click again a bit later
+    events = [{"at": random.uniform(0, spread), "user": first_user + i} for i in range(reactions)]
+    for event in random.sample(events, int(reactions * repeat_ratio)):
+        events.append({"at": event["at"] + random.uniform(0, 2), "user": event["user"]})
+    return sorted(events, key=lambda e: e["at"])
+
+
+def load_traffic(file_name):
+    # one json object per line: {"at": <seconds from the start>, "user": <user id>}
+    with open(file_name, encoding="UTF8") as file:
+        return sorted((json.loads(line) for line in file if line.strip() != ""), key=lambda e: e["at"])
+
+
+def save_traffic(file_name, events):
+    with open(file_name, "w", encoding="UTF8") as file:
+        for event in events:
+            file.write(json.dumps(event) + "\n")
+
+
+async def prepare(fake, directory, codes, admin, role, log_channel, announcement_channel):
+    with open(os.path.join(directory, "config.yaml"), "w", encoding="UTF8") as file:
+        yaml.dump({
+            "token": "replay",
+            "prefix": "!",
+            "admin_id": admin,
+            "log_channel": log_channel,
+            "announcement_channel": announcement_channel,
+            "tester_role": role,
+            "reaction_emoji": REACTION,
+            "emoji": {},
+            "database": {"url": f"sqlite://{os.path.join(directory, 'replay.sqlite3')}"},
+        }, file, allow_unicode=True)
+    # the bot loads its cogs by module name, keep the repository importable once we moved into the temporary directory
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.chdir(directory)
+    Configuration.load()
+
+    await Database.init()
+    await Migrations.run()
+    game = await Game.create(name="replay")
+    await Tortoise.get_connection("default").execute_many('INSERT INTO "gamecode" ("code", "game_id") VALUES (?, ?)',
+                                                          [[f"REPLAY-{i:08}", game.id] for i in range(codes)])
+    message = fake.add_message(announcement_channel, f"Replay test announcement\n<@&{role}>")
+    await NewGameTest.create(game=game, message=message, end=datetime.now() + timedelta(days=7))
+    # the bot sets up its own connections once it's ready
+    await Tortoise.close_connections()
+    return message
+
+
+async def wait_until_ready(bot, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        cog = bot.get_cog("GameTesting")
+        if cog is not None and cog.announcements_loaded.is_set():
+            return
+        await asyncio.sleep(0.1)
+    raise TimeoutError("The bot didn't finish starting up in time")
+
+
+async def run(args):
+    fake = FakeDiscord(rate_limits=not args.no_rate_limits)
+    discord.http.Route.BASE = await fake.start()
+
+    admin = fake.snowflake()
+    fake.add_user(admin, "admin")
+    role = fake.add_role("testers")
+    log_channel = fake.add_channel("bot-log")
+    announcement_channel = fake.add_channel("announcements")
+
+    if args.traffic is not None:
+        events = load_traffic(args.traffic)
+    else:
+        events = synthetic_traffic(args.reactions, args.spread, args.repeat_ratio, fake.snowflake())
+    if args.save_traffic is not None:
+        save_traffic(args.save_traffic, events)
+    for user in set(e["user"] for e in events):
+        fake.add_user(user, roles=[role])
+
+    directory = tempfile.mkdtemp(prefix="gamedjinnie-replay-")
+    message = await prepare(fake, directory, args.codes, admin, role, log_channel, announcement_channel)
+
+    bot = GameJinnie(command_prefix=Configuration.CONFIG.prefix, case_insensitive=True)
+    bot_task = asyncio.ensure_future(bot.start(Configuration.CONFIG.token))
+    try:
+        await wait_until_ready(bot, 60)
+        print(f"Bot ready, replaying {len(events)} reactions from {len(set(e['user'] for e in events))} users")
+
+        sent = dict()
+        started = time.perf_counter()
+        for event in events:
+            delay = event["at"] - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            sent.setdefault(event["user"], time.perf_counter())
+            await fake.add_reaction(event["user"], announcement_channel, message, REACTION)
+
+        await asyncio.gather(*[fake.wait_for_dm(user, args.timeout) for user in sent], return_exceptions=True)
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.close()
+        await bot_task
+        await fake.stop()
+
+    latencies = {user: fake.dms[user][0][0] - sent_at for user, sent_at in sent.items() if len(fake.dms[user]) > 0}
+    values = list(latencies.values())
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "reactions": len(events),
+        "users": len(sent),
+        "answered": len(latencies),
+        "seconds": round(elapsed, 3),
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p90_ms": round(percentile(values, 90) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "max_ms": round(max(values, default=0) * 1000, 1),
+        "rest_calls": dict(fake.calls),
+        "rate_limited": dict(fake.rate_limited),
+        "latencies_ms": {str(user): round(latency * 1000, 1) for user, latency in latencies.items()},
+    }
+    print(json.dumps({k: v for k, v in report.items() if k != "latencies_ms"}, indent=2))
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="UTF8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replays reaction traffic against the bot through a local fake discord")
+    parser.add_argument("--reactions", type=int, default=2000, help="amount of testers reacting in synthetic traffic")
+    parser.add_argument("--spread", type=float, default=60, help="seconds over which synthetic reactions come in")
+    parser.add_argument("--repeat-ratio", type=float, default=0.1, help="part of the testers that click again")
+    parser.add_argument("--traffic", help="json lines file with recorded traffic to replay instead")
+    parser.add_argument("--save-traffic", help="save the traffic that was replayed so it can be used again")
+    parser.add_argument("--codes", type=int, default=5000, help="amount of codes available for the test")
+    parser.add_argument("--timeout", type=float, default=600, help="how long to wait for everyone to get a DM")
+    parser.add_argument("--no-rate-limits", action="store_true", help="don't simulate discord's rate limits")
+    parser.add_argument("--output",
+                        default=os.path.abspath(f"bench_results/replay-{datetime.now():%Y-%m-%d_%H-%M-%S}.json"))
+    asyncio.get_event_loop().run_until_complete(run(parser.parse_args()))
@@ -0,0 +1,163 @@
+import asyncio
+import itertools
+
+from aiohttp import web
+
+IDS = itertools.count(100000000000000000)
+
+
+# just enough of discord.py's objects for the cog's code paths, everything sent is recorded instead of going anywhere
+class StubMessage:
+    def __init__(self, channel, content=None):
+        self.id = next(IDS)
+        self.channel = channel
+        self.content = content
+        self.attachments = list()
+        self.removed_reactions = list()
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+
+    async def add_reaction(self, emoji):
+        pass
+
+    async def remove_reaction(self, emoji, member):
+        self.removed_reactions.append((emoji, member.id))
+
+
+class StubMessageable:
+    def __init__(self):
+        self.id = next(IDS)
+        self.sent = list()
+        self.messages = dict()
+
+    async def send(self, content=None, **kwargs):
+        message = StubMessage(self, content)
+        self.sent.append((content, kwargs))
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        if message_id not in self.messages:
+            self.messages[message_id] = StubMessage(self)
+            self.messages[message_id].id = message_id
+        return self.messages[message_id]
+
+
+class StubUser(StubMessageable):
+    def __init__(self, user_id):
+        super().__init__()
+        self.id = user_id
+        self.mention = f"<@{user_id}>"
+
+    def __str__(self):
+        return f"tester#{self.id % 10000:04}"
+
+
+class StubRole:
+    def __init__(self, role_id):
+        self.id = role_id
+        self.mention = f"<@&{role_id}>"
+        self.members = list()
+
+    async def edit(self, **kwargs):
+        pass
+
+
+class StubGuild:
+    def __init__(self, role):
+        self.id = next(IDS)
+        self.role = role
+        self.filesize_limit = 8 * 1024 * 1024
+
+    def get_role(self, role_id):
+        return self.role
+
+    def get_channel(self, channel_id):
+        return self.channel
+
+
+class StubChannel(StubMessageable):
+    def __init__(self, guild):
+        super().__init__()
+        self.guild = guild
+        self.name = "announcements"
+        guild.channel = self
+
+
+class StubAttachment:
+    def __init__(self, url):
+        self.url = url
+
+
+class StubContext(StubMessageable):
+    def __init__(self, author, guild, attachments=None):
+        super().__init__()
+        self.author = author
+        self.guild = guild
+        self.message = StubMessage(self)
+        self.message.attachments = attachments or list()
+
+
+class StubEmoji:
+    name = "😛"
+    id = None
+
+    def __str__(self):
+        return self.name
+
+
+class StubPayload:
+    def __init__(self, user_id, message_id, channel_id, guild_id):
+        self.user_id = user_id
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.emoji = StubEmoji()
+
+
+class StubBot:
+    def __init__(self, channel, admin_id):
+        self.loop = asyncio.get_event_loop()
+        self.user = StubUser(next(IDS))
+        self.channel = channel
+        self.guilds = [channel.guild]
+        self.users = {admin_id: StubUser(admin_id)}
+
+    def get_user(self, user_id):
+        if user_id not in self.users:
+            self.users[user_id] = StubUser(user_id)
+        return self.users[user_id]
+
+    def get_channel(self, channel_id):
+        return self.channel
+
+    def get_guild(self, guild_id):
+        return self.channel.guild
+
+
+class FileServer:
+    # serves attachment contents over http so the streaming import reads them the same way it reads from discord
+    def __init__(self):
+        self.files = dict()
+        self.runner = None
+        self.port = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/{name}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def handle(self, request):
+        return web.Response(body=self.files[request.match_info["name"]])
+
+    def add(self, name, content):
+        self.files[name] = content
+        return StubAttachment(f"http://127.0.0.1:{self.port}/{name}")
+
+    async def stop(self):
+        await self.runner.cleanup()
@@ -0,0 +1,252 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from tortoise import Tortoise
+
+from Benchmarks.Stubs import IDS, StubBot, StubChannel, StubContext, StubGuild, StubPayload, StubRole, StubUser, \
+    FileServer
+from Utils import Configuration, Database, Logging, Migrations, Guilds, CodeAllocator
+from Utils.Models import Game, GameCode, NewGameTest, TestStatus
+
+ADMIN_ID = 1
+
+PRESETS = {
+    "small": {
+        "pools": [1000, 10000],
+        "bursts": [10, 100, 500],
+        "imports": [1000, 10000],
+        "completions": [10000, 100000],
+        "tests": [100, 1000],
+    },
+    "full": {
+        "pools": [1000, 10000, 100000, 1000000],
+        "bursts": [10, 100, 1000, 5000],
+        "imports": [1000, 10000, 100000, 200000],
+        "completions": [10000, 100000, 1000000, 5000000],
+        "tests": [100, 1000, 10000],
+    }
+}
+
+SEED_BATCH_SIZE = 10000
+
+
+def percentile(values, percent):
+    if len(values) == 0:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def result(benchmark, params, operations, seconds, latencies):
+    entry = {
+        "benchmark": benchmark,
+        "params": params,
+        "operations": operations,
+        "seconds": round(seconds, 4),
+        "throughput": round(operations / seconds, 2) if seconds > 0 else 0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+    print(f"{benchmark:<12} {json.dumps(params):<40} {entry['throughput']:>12}/s  "
+          f"p50 {entry['p50_ms']:>9}ms  p99 {entry['p99_ms']:>9}ms")
+    return entry
+
+
+async def seed(query, rows):
+    connection = Tortoise.get_connection("default")
+    for start in range(0, len(rows), SEED_BATCH_SIZE):
+        await connection.execute_many(query, rows[start:start + SEED_BATCH_SIZE])
+
+
+async def seed_codes(game, amount):
+    await seed('INSERT INTO "gamecode" ("code", "game_id") VALUES (?, ?)',
+               [[f"{game.name}-{i:08}", game.id] for i in range(amount)])
+
+
+async def create_test(cog, game, channel, end):
+    message = await channel.send("Benchmark test announcement")
+    test = await NewGameTest.create(game=game, message=message.id, end=end)
+    cog.announcements[test.message] = test.status
+    return test
+
+
+async def check_claim(cog, channel):
+    # timing claims only means something if they hand out codes
+    game = await Game.create(name="claim_check", guild=channel.guild.id)
+    await seed_codes(game, 1)
+    test = await create_test(cog, game, channel, datetime.now() + timedelta(days=7))
+    user_id = next(IDS)
+    code, _ = await CodeAllocator.claim(game.id, user_id, test.id)
+    stored = await GameCode.get_or_none(code=code)
+    if stored is None or stored.claimed_by != user_id or stored.claimed_in_id != test.id:
+        raise AssertionError(f"Claiming a code didn't store who claimed it in which test: {stored}")
+
+
+async def bench_claims(cog, channel, pools, bursts):
+    results = list()
+    for pool in pools:
+        game = await Game.create(name=f"claims_{pool}", guild=channel.guild.id)
+        # every burst gets its own test and fresh testers, seed enough codes so the pool never runs dry
+        await seed_codes(game, pool + sum(bursts))
+        for burst in bursts:
+            test = await create_test(cog, game, channel, datetime.now() + timedelta(days=7))
+            cog.reactions.latencies.clear()
+            start = time.perf_counter()
+            await asyncio.gather(*[cog.on_raw_reaction_add(StubPayload(next(IDS), test.message, channel.id, channel.guild.id))
+                                   for _ in range(burst)])
+            await cog.reactions.queue.join()
+            elapsed = time.perf_counter() - start
+            # failed claims are fast, they can't count towards the throughput
+            claimed = await GameCode.filter(claimed_in_id=test.id).count()
+            if claimed != burst:
+                raise AssertionError(f"Only {claimed} of {burst} claims handed out a code")
+            results.append(result("claim", {"pool": pool, "burst": burst}, claimed, elapsed,
+                                  list(cog.reactions.latencies)))
+    return results
+
+
+async def bench_imports(cog, files, admin, guild, sizes):
+    results = list()
+    for size in sizes:
+        game = await Game.create(name=f"import_{size}", guild=guild.id)
+        # a tenth of the lines are duplicates to exercise the dedupe
+        lines = [f"import-{size}-{i:08}" for i in range(size)]
+        lines += random.sample(lines, size // 10)
+        random.shuffle(lines)
+        attachment = files.add(f"import-{size}.txt", "\n".join(lines).encode())
+        ctx = StubContext(admin, guild, [attachment])
+        start = time.perf_counter()
+        await cog.add_codes.callback(cog, ctx, game)
+        elapsed = time.perf_counter() - start
+        results.append(result("add_codes", {"lines": len(lines)}, len(lines), elapsed, [elapsed]))
+    return results
+
+
+async def bench_reports(cog, channel, sizes, repeats):
+    results = list()
+    for size in sizes:
+        game = await Game.create(name=f"report_{size}", guild=channel.guild.id)
+        test = await create_test(cog, game, channel, datetime.now() + timedelta(days=7))
+        testers = [next(IDS) for _ in range(1000)]
+        await seed('INSERT INTO "gamecode" ("code", "game_id", "claimed_by", "claimed_in_id") VALUES (?, ?, ?, ?)',
+                   [[f"report-{size}-{i:08}", game.id, user, test.id] for i, user in enumerate(testers)])
+        await seed('INSERT INTO "completion" ("test_id", "user") VALUES (?, ?)',
+                   [[test.id, random.choice(testers)] for _ in range(size)])
+        latencies = list()
+        for _ in range(repeats):
+            start = time.perf_counter()
+            await cog._test_report(channel, test)
+            latencies.append(time.perf_counter() - start)
+        results.append(result("test_report", {"completions": size}, repeats, sum(latencies), latencies))
+    return results
+
+
+async def bench_scheduler(cog, sizes, repeats):
+    results = list()
+    game = await Game.create(name="scheduler", guild=cog.bot.channel.guild.id)
+    end = datetime.now() + timedelta(days=30)
+    created = 0
+    for size in sizes:
+        await seed('INSERT INTO "newgametest" ("game_id", "message", "end", "status") VALUES (?, ?, ?, ?)',
+                   [[game.id, next(IDS), end, int(TestStatus.STARTED)] for _ in range(size - created)])
+        created = size
+        latencies = list()
+        for _ in range(repeats):
+            start = time.perf_counter()
+            await cog.scheduler()
+            latencies.append(time.perf_counter() - start)
+        results.append(result("scheduler", {"tests": size}, repeats, sum(latencies), latencies))
+    return results
+
+
+async def run(preset, repeats, output):
+    directory = tempfile.mkdtemp(prefix="gamedjinnie-bench-")
+    Configuration.load({
+        "token": "bench",
+        "prefix": "!",
+        "log_channel": 1,
+        "admin_id": ADMIN_ID,
+        "announcement_channel": 1,
+        "tester_role": 1,
+        "reaction_emoji": "😛",
+        # a burst arrives all at once, nothing should be dropped
+        "claim_queue_size": max(preset["bursts"]),
+        "database": {"url": f"sqlite://{os.path.join(directory, 'bench.sqlite3')}"},
+    })
+    await Database.init()
+    await Migrations.run()
+
+    role = StubRole(next(IDS))
+    guild = StubGuild(role)
+    channel = StubChannel(guild)
+    bot = StubBot(channel, ADMIN_ID)
+    await Guilds.load(bot)
+    Logging.BOT_LOG_CHANNEL = channel
+    files = FileServer()
+    await files.start()
+
+    # imported here so the configuration is in place before the cog reads it
+    from Cogs.GameTesting import GameTesting
+    cog = GameTesting(bot)
+    await cog.announcements_loaded.wait()
+
+    results = list()
+    try:
+        await check_claim(cog, channel)
+        results += await bench_claims(cog, channel, preset["pools"], preset["bursts"])
+        results += await bench_imports(cog, files, StubUser(ADMIN_ID), guild, preset["imports"])
+        results += await bench_reports(cog, channel, preset["completions"], repeats)
+        results += await bench_scheduler(cog, preset["tests"], repeats)
+    finally:
+        cog.cog_unload()
+        await files.stop()
+        await Tortoise.close_connections()
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results
+    }
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="UTF8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to {output}")
+    return report
+
+
+def key(entry):
+    return entry["benchmark"], json.dumps(entry["params"], sort_keys=True)
+
+
+def compare(report, baseline_file):
+    with open(baseline_file, encoding="UTF8") as file:
+        baseline = {key(e): e for e in json.load(file)["results"]}
+    print(f"\nCompared to {baseline_file}:")
+    for entry in report["results"]:
+        old = baseline.get(key(entry))
+        if old is None or old["throughput"] == 0:
+            continue
+        change = (entry["throughput"] - old["throughput"]) / old["throughput"] * 100
+        print(f"{entry['benchmark']:<12} {json.dumps(entry['params']):<40} throughput {change:+7.1f}%  "
+              f"p99 {old['p99_ms']}ms -> {entry['p99_ms']}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the code claim, import, report and scheduler paths")
+    parser.add_argument("--preset", choices=PRESETS.keys(), default="small")
+    parser.add_argument("--repeats", type=int, default=5, help="how often to repeat the report and scheduler runs")
+    parser.add_argument("--output", default=f"bench_results/{datetime.now():%Y-%m-%d_%H-%M-%S}.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.get_event_loop().run_until_complete(run(PRESETS[args.preset], args.repeats, args.output))
+    if args.compare is not None:
+        compare(report, args.compare)
@@ -1,85 +1,237 @@
 import asyncio
 import csv
-from collections import Counter
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta
 from io import StringIO
 
+import aiohttp
 import discord
-from discord import Forbidden, RawReactionActionEvent, Object, Embed
+from discord import Forbidden, RawReactionActionEvent, Embed
 from discord.ext import commands, tasks
 from discord.ext.commands import Cog
 from tortoise.exceptions import DoesNotExist
-from tortoise.transactions import atomic
+from tortoise.transactions import in_transaction
 
 from typing import Optional
 
 import humanize
 
-from Utils import Configuration, Logging, SheetUtils
+from Utils import Configuration, Logging, SheetUtils, CodeAllocator, Utils, Export, Database, Activity, Metrics, Cache, \
+    Outbox, Guilds, Members
 from Utils.Converters import GameConverter, dateConverter, TestConverter, Sheetconverter
-from Utils.Models import GameCode, Game, GameTest, TestStatus, Completion, NewGameTest
+from Utils.Export import CsvExport
+from Utils.Models import GameCode, Game, GameTest, TestStatus, Completion, NewGameTest, FeedbackSync, GuildConfig
+from Utils.Outbox import OutboxSender
+from Utils.Profiler import Profiler
+from Utils.ReactionQueue import ReactionQueue
+from Utils.Scheduler import Scheduler, RETRY_DELAY
 from Utils.Utils import with_role_ping
 
+# sqlite can't take more than 999 variables per query, stay well below that
+IMPORT_BATCH_SIZE = 500
+FEEDBACK_BATCH_SIZE = 500
+EXPORT_PAGE_SIZE = 1000
+# reminders that come due within this many seconds of each other go out as a single announcement
+REMINDER_BATCH_DELAY = 5
+# keeps reminder announcements well below discord's 2000 character limit
+REMINDERS_PER_MESSAGE = 15
+
 
 class GameTesting(Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.scheduler_loop.start()
+        # message id -> status for every test announcement, so reactions on other messages never touch the database
+        self.announcements = dict()
+        self.announcements_loaded = asyncio.Event()
+        self.timers = Scheduler(bot, self.handle_deadline, Configuration.CONFIG.scheduler_concurrency)
+        # test id -> test that needs a reminder, sent together once the batch delay passed
+        self.due_reminders = dict()
+        self.reminder_batch = None
+        self.bot.loop.create_task(self.load_announcements())
+        self.reactions = ReactionQueue(bot, self.handle_reaction, Configuration.CONFIG.claim_workers,
+                                       Configuration.CONFIG.claim_queue_size)
+        # only one sync per test at a time, or we would ingest the same rows twice
+        self.feedback_locks = defaultdict(asyncio.Lock)
+        self.feedback_sync_loop.change_interval(minutes=Configuration.CONFIG.feedback_sync_minutes)
+        self.feedback_sync_loop.start()
+        self.outbox = OutboxSender(bot, Configuration.CONFIG.outbox_workers)
+
+    def cog_unload(self):
+        self.timers.stop()
+        self.reactions.stop()
+        self.outbox.stop()
+        if self.reminder_batch is not None:
+            self.reminder_batch.cancel()
+        self.feedback_sync_loop.cancel()
+
+    async def load_announcements(self):
+        for message, status in await NewGameTest.all().values_list("message", "status"):
+            self.announcements[message] = TestStatus(status)
+        self.announcements_loaded.set()
+        await self.scheduler()
 
     async def cog_check(self, ctx):
-        return ctx.author.id == Configuration.get_var("admin_id")
+        # the admin from the config file runs the whole install, every guild has its own admin as well
+        if ctx.author.id == Configuration.CONFIG.admin_id:
+            return True
+        config = Guilds.get(ctx.guild.id) if ctx.guild is not None else None
+        return config is not None and ctx.author.id == config.admin_id
+
+    async def guild_config(self, ctx):
+        config = Guilds.get(ctx.guild.id) if ctx.guild is not None else None
+        if config is None:
+            await ctx.send("This server isn't set up for testing yet, please use the setup_guild command first")
+        return config
+
+    async def test_config(self, test):
+        return Guilds.get((await Cache.get_game_by_id(test.game_id)).guild)
+
+    async def cog_before_invoke(self, ctx):
+        ctx.started = time.perf_counter()
+
+    async def cog_after_invoke(self, ctx):
+        Metrics.COMMAND_LATENCY.observe(time.perf_counter() - ctx.started, command=ctx.command.qualified_name)
+
+    @commands.command()
+    @commands.guild_only()
+    async def setup_guild(self, ctx, announcement_channel: discord.TextChannel, tester_role: discord.Role,
+                          reaction_emoji: str, admin: Optional[discord.Member] = None):
+        config = Guilds.get(ctx.guild.id)
+        if config is None:
+            config = GuildConfig(guild=ctx.guild.id)
+        config.announcement_channel = announcement_channel.id
+        config.tester_role = tester_role.id
+        config.reaction_emoji = reaction_emoji
+        config.admin_id = (admin or ctx.author).id
+        await config.save()
+        Guilds.put(config)
+        await ctx.send(f"Tests for this server will be announced in {announcement_channel.mention}!")
 
     @commands.command()
     async def add_game(self, ctx, *, name: str):
+        config = await self.guild_config(ctx)
+        if config is None:
+            return
         name = name.lower().replace(" ", "_")
         try:
-            await Game.get(name=name)
+            await Game.get(name=name, guild=config.guild)
         except DoesNotExist:
-            await Game.create(name=name)
+            Cache.put_game(await Game.create(name=name, guild=config.guild))
             await ctx.send(f"Added {name} to the list of games!")
         else:
             await ctx.send(f"A game named {name} already exists!")
 
     @commands.command()
     async def add_codes(self, ctx, game: GameConverter):
-        if len(ctx.message.attachments) is not 1:
+        if len(ctx.message.attachments) != 1:
             await ctx.send("Please send the txt file with codes with the command")
+            return
+        progress = await ctx.send(f"Importing codes for {game}...")
+        seen = set()
+        inserted = 0
+        skipped = 0
+        batches = 0
+        try:
+            # only the database work of a batch is in a transaction, claims shouldn't wait on the download or discord
+            async for batch in Utils.batched(Utils.attachment_lines(ctx.message.attachments[0]), IMPORT_BATCH_SIZE):
+                new_codes = list()
+                for code in batch:
+                    if code in seen:
+                        skipped += 1
+                    else:
+                        seen.add(code)
+                        new_codes.append(code)
+                if len(new_codes) == 0:
+                    continue
+                async with in_transaction():
+                    existing = set(await GameCode.filter(code__in=new_codes).values_list("code", flat=True))
+                    to_insert = [GameCode(code=c, game=game) for c in new_codes if c not in existing]
+                    if len(to_insert) > 0:
+                        await GameCode.bulk_create(to_insert)
+                inserted += len(to_insert)
+                skipped += len(existing)
+                batches += 1
+                if batches % 20 == 0:
+                    await progress.edit(content=f"Importing codes for {game}... {inserted} imported so far")
+        except (aiohttp.ClientError, UnicodeDecodeError) as ex:
+            await ctx.send(
+                f"Something went wrong reading that file after importing {inserted} codes, please make sure the file is valid and try again (codes that were already imported are skipped)")
+            Logging.error(ex)
         else:
-            try:
-                codes = (await ctx.message.attachments[0].read()).decode().splitlines()
-            except Exception:
-                await ctx.send(
-                    "Something went wrong reading that file, please make sure the file is valid and try again")
-            else:
-                for c in await GameCode.filter(code__in=codes):
-                    codes.remove(c.code)
-                await GameCode.bulk_create([GameCode(code=c, game=game) for c in codes])
-                await ctx.send(f"Successfully imported {len(codes)} codes for {game}!")
+            await progress.edit(
+                content=f"Successfully imported {inserted} codes for {game}! Skipped {skipped} duplicate or already known codes")
+        finally:
+            await CodeAllocator.reset(game.id)
 
     @commands.command()
-    async def remove_codes(self, ctx):
-        if len(ctx.message.attachments) is not 1:
+    async def remove_codes(self, ctx, dry_run: bool = False):
+        if len(ctx.message.attachments) != 1:
             await ctx.send("Please send the txt file with codes with the command")
-        else:
-            try:
-                codes = (await ctx.message.attachments[0].read()).decode().splitlines()
-            except Exception as ex:
+            return
+        seen = set()
+        games = set()
+        deleted = 0
+        claimed = 0
+        missing = 0
+        # codes of other guilds' games count as unknown, the admin from the config file in DMs can reach them all
+        scope = dict(game__guild=ctx.guild.id) if ctx.guild is not None else dict()
+        try:
+            # a transaction per batch, nothing is locked while the file downloads
+            async for batch in Utils.batched(Utils.attachment_lines(ctx.message.attachments[0]), IMPORT_BATCH_SIZE):
+                codes = [c for c in batch if c not in seen]
+                seen.update(codes)
+                if len(codes) == 0:
+                    continue
+                async with in_transaction():
+                    found = await GameCode.filter(code__in=codes, **scope).values_list("code", "claimed_by", "game_id")
+                    if not dry_run and len(found) > 0:
+                        # tortoise can't delete through a join, these are limited to the guild's games already
+                        await GameCode.filter(code__in=[c[0] for c in found],
+                                              game_id__in=list(set(c[2] for c in found))).delete()
+                missing += len(codes) - len(found)
+                for code, claimed_by, game_id in found:
+                    games.add(game_id)
+                    if claimed_by is None:
+                        deleted += 1
+                    else:
+                        claimed += 1
+        except (aiohttp.ClientError, UnicodeDecodeError) as ex:
+            if dry_run:
                 await ctx.send(
                     "Something went wrong reading that file, please make sure the file is valid and try again")
-                Logging.error(ex)
             else:
-                await GameCode.filter(code__in=codes).delete()
-                await ctx.send(f"Successfully deleted those codes!")
+                await ctx.send(
+                    f"Something went wrong reading that file after deleting {deleted + claimed} codes, please make sure the file is valid and try again")
+            Logging.error(ex)
+        else:
+            if dry_run:
+                await ctx.send(
+                    f"Dry run: {deleted} unclaimed and {claimed} already claimed codes would be deleted, {missing} codes are unknown")
+            else:
+                await ctx.send(
+                    f"Successfully deleted {deleted} unclaimed and {claimed} already claimed codes, {missing} codes were unknown")
+        finally:
+            if not dry_run:
+                for game_id in games:
+                    await CodeAllocator.reset(game_id)
 
     @commands.command()
     @with_role_ping()
     async def test(self, ctx, game: GameConverter, until: dateConverter, sheet_url: Optional[Sheetconverter] = None, *, announcement):
-        channel = self.bot.get_channel(Configuration.get_var("announcement_channel"))
-        role = channel.guild.get_role(Configuration.get_var("tester_role"))
-        reaction = Configuration.get_var("reaction_emoji")
+        config = await self.guild_config(ctx)
+        if config is None:
+            return
+        channel, role = Guilds.resolve(self.bot, config)
         message = await channel.send(f"{announcement}\n{role.mention}")
-        await message.add_reaction(reaction)
-        gt = await NewGameTest.create(game=game, message=message.id, end=until, feedback=sheet_url)
+        await message.add_reaction(config.reaction_emoji)
+        gt = await NewGameTest.create(game=game, message=message.id, end=until, feedback=sheet_url,
+                                      content=message.content)
+        self.announcements[gt.message] = gt.status
+        Cache.put_test(gt)
+        if sheet_url is not None:
+            Cache.sheet_used(sheet_url)
+        self.schedule_test(gt)
         await ctx.send(f"Test running until {humanize.naturaldate(gt.end)} has started!")
 
     @commands.Cog.listener()
@@ -87,82 +239,117 @@ class GameTesting(Cog):
         # ignore the bot itself
         if payload.user_id == self.bot.user.id:
             return
-        await self.give_code(payload)
-
-    @atomic()
-    async def give_code(self, payload):
-        user = self.bot.get_user(payload.user_id)
-
-        async def message_user(message):
+        await self.announcements_loaded.wait()
+        status = self.announcements.get(payload.message_id)
+        if status is None:
+            return  # not an announcement, nothing to do
+        if not self.reactions.put((payload.user_id, payload.message_id), payload):
+            # too busy to take it, removing the reaction lets them know to try again
             try:
-                await user.send(message)
-            except Forbidden:
-                # user has DMs closed, remove their reaction to indicate this
-                message = await self.bot.get_channel(payload.channel_id).fetch_message(payload.message_id)
-                await message.remove_reaction(payload.emoji, Object(payload.user_id))
+                await self.bot.http.remove_reaction(payload.channel_id, payload.message_id,
+                                                    Outbox.reaction_key(payload.emoji), payload.user_id)
+            except discord.HTTPException as ex:
+                Logging.warn(f"Failed to remove the dropped reaction of {payload.user_id}: {ex}")
+
+    async def handle_reaction(self, payload):
+        if self.announcements.get(payload.message_id) == TestStatus.ENDED:
+            await self.test_ended(payload)
+        else:
+            with Metrics.timed(Metrics.CLAIM_LATENCY):
+                await self.give_code(payload)
 
+    async def test_ended(self, payload):
+        # users aren't cached in low memory mode
+        user = self.bot.get_user(payload.user_id) or await self.bot.fetch_user(payload.user_id)
         try:
-            test = await NewGameTest.get(message=payload.message_id)
-        except DoesNotExist:
-            return  # not an announcement, nothing to do
+            await user.send("This test has already ended")
+        except Forbidden:
+            pass
+        await self.bot.http.remove_reaction(payload.channel_id, payload.message_id,
+                                            Outbox.reaction_key(payload.emoji), payload.user_id)
+
+    async def give_code(self, payload):
+        # replies go through the outbox, so the claim is committed before we talk to discord
+        async with in_transaction():
+            test = await NewGameTest.get_or_none(message=payload.message_id)
+            if test is None:
+                return  # removed from the database after the index was built
+            if test.status != TestStatus.ENDED:
+                await self.claim_code(test, payload)
+        if test.status == TestStatus.ENDED:
+            self.announcements[test.message] = test.status
+            await self.test_ended(payload)
         else:
-            if test.status == TestStatus.ENDED:
-                try:
-                    await user.send("This test has already ended")
-                except Forbidden:
-                    pass
-                message = await self.bot.get_channel(payload.channel_id).fetch_message(payload.message_id)
-                await message.remove_reaction(payload.emoji, Object(payload.user_id))
-                return
-            try:
-                await test.fetch_related("game")
-                exising_code = await GameCode.get(game=test.game, claimed_by=payload.user_id)
-            except DoesNotExist:
-                # doesn't have a code, fetch one for claiming
-                code = await GameCode.filter(game=test.game, claimed_by=None).first()
-                if code is None:
-                    # no more codes are available!
-                    await message_user(
-                        f"Sadly there are no more codes available for {test.game} at this time. Please try again later")
-                else:
-                    # try to claim that code but make sure we don't override races
-                    updated = await GameCode.filter(code=code.code, claimed_by=None).update(
-                        claimed_by=payload.user_id)
-                    # make sure we updated that row
-                    if updated == 1:
-
-                        try:
-                            await user.send(f"Your code for {test.game} is {code}!")
-                        except Forbidden:
-                            # failed to send, free up the code again
-                            await GameCode.filter(code=code.code).update(clamied_by=None)
-
-                        # code claimed, make sure we have more codes left
-                        available = await GameCode.filter(game=test.game, claimed_by=None, claimed_in=None).count()
-                        if available is 0:
-                            # this was the last one, inform admin
-                            admin = self.bot.get_user(Configuration.get_var('admin_id'))
-                            try:
-                                await admin.send(f"Someone just claimed the last available code for {test.game}!")
-                            except Forbidden:
-                                # admin has DMs closed, fall back to botlog
-                                await Logging.bot_log(
-                                    f"{admin.mention} Someone just claimed the last available code for {test.game}!")
+            self.outbox.wake()
+
+    async def claim_code(self, test, payload):
+        async def message_user(message, outcome, **kwargs):
+            Metrics.CLAIMS.inc(outcome=outcome)
+            await Outbox.dm(config.guild, payload.user_id, message, payload=payload, **kwargs)
+
+        await test.fetch_related("game")
+        config = Guilds.get(test.game.guild)
+        existing_code = await GameCode.get_or_none(game=test.game, claimed_by=payload.user_id)
+        if existing_code is not None:
+            # user already has a code, send it to them again
+            await message_user(
+                f"You already claimed a code for {test.game} before: {existing_code}. If this code didn't work please contact <@{config.admin_id}>",
+                "already_had")
+            return
+        # doesn't have a code, claim one
+        code, available = await CodeAllocator.claim(test.game.id, payload.user_id, test.id)
+        if code is None:
+            # no more codes are available!
+            await message_user(
+                f"Sadly there are no more codes available for {test.game} at this time. Please try again later",
+                "none_left")
+            return
+        # if this can't be delivered the outbox frees up the code again
+        await message_user(f"Your code for {test.game} is {code}!", "claimed", code=code, game_id=test.game.id)
 
-                    else:
-                        # we didn't claim, probably someone else won the race, try again
-                        await self.give_code(payload)
-            else:
-                # user already has a code, send it to them again
-                user = self.bot.get_user(payload.user_id)
-                await message_user(
-                    f"You already claimed a code for {test.game} before: {exising_code}. If this code didn't work please contact <@{Configuration.get_var('admin_id')}>")
+        # code claimed, make sure we have more codes left
+        if available == 0:
+            # this was the last one, inform admin
+            await Outbox.admin(config, f"Someone just claimed the last available code for {test.game}!")
+
+    @commands.command()
+    async def claim_stats(self, ctx):
+        # the queue is shared by every guild, guild admins don't get to see it
+        if ctx.author.id != Configuration.CONFIG.admin_id:
+            return
+        embed = Embed(title="Code claims")
+        for name, value in self.reactions.stats().items():
+            embed.add_field(name=name, value=value)
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    async def profile(self, ctx, seconds: int = 30, top: int = 25):
+        # profiles everything the bot does for every guild, guild admins don't get to run it
+        if ctx.author.id != Configuration.CONFIG.admin_id:
+            return
+        seconds = max(1, min(seconds, 300))
+        profiler = Profiler([__file__])
+        try:
+            profiler.start()
+        except RuntimeError:
+            await ctx.send("A profile is already being recorded, please wait for it to finish")
+            return
+        await ctx.send(f"Profiling for {seconds} seconds...")
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+        await ctx.send(files=[discord.File(StringIO(profiler.collapsed()), "profile.folded"),
+                              discord.File(StringIO(profiler.summary(top)), "profile summary.txt")])
 
     @commands.command()
     async def running(self, ctx):
-        channel = self.bot.get_channel(Configuration.get_var("announcement_channel"))
-        active_tests = await NewGameTest.filter(status__not=TestStatus.ENDED).order_by("-end").limit(20).prefetch_related(
-            "game")
+        config = await self.guild_config(ctx)
+        if config is None:
+            return
+        channel, _ = Guilds.resolve(self.bot, config)
+        active_tests = await NewGameTest.filter(status__not=TestStatus.ENDED, game__guild=config.guild).order_by(
+            "-end").limit(20).prefetch_related("game")
         embed = Embed(description="\n".join(
             f"[{test.id} - {test.game.name}: ending in {humanize.naturaltime(datetime.now() - test.end)}](https://canary.discordapp.com/channels/{channel.guild.id}/{channel.id}/{test.message})"
             for test in active_tests))
@@ -170,10 +357,13 @@ class GameTesting(Cog):
 
     @commands.command()
     async def update(self, ctx, test: TestConverter, *, new_content):
-        channel = self.bot.get_channel(Configuration.get_var("announcement_channel"))
-        message = await channel.fetch_message(test.message)
+        config = await self.test_config(test)
         # edit message to new content + role ping
-        await message.edit(content=f"{new_content}\n<@&{Configuration.get_var('tester_role')}>")
+        content = f"{new_content}\n<@&{config.tester_role}>"
+        await self.bot.http.edit_message(config.announcement_channel, test.message, content=content)
+        # keep it around so we don't need to fetch the message when the test ends
+        test.content = content
+        await test.save()
         await ctx.send("Message updated!")
 
     @commands.command()
@@ -181,73 +371,187 @@ class GameTesting(Cog):
         # set new end time
         test.end = new_time
         await test.save()
-        # run the scheduler so we pick up on the date being lowered
+        await Activity.test_moved(test)
+        self.announcements[test.message] = test.status
+        Cache.put_test(test)
+        # reschedule so we pick up on the date being changed
+        self.schedule_test(test)
         await ctx.send("End time updated!")
-        await self.scheduler()
-
-    @tasks.loop(minutes=10)
-    async def scheduler_loop(self):
-        await self.scheduler()
 
     async def scheduler(self):
-        # schedule 24 notices
-        for t in await NewGameTest.filter(status=TestStatus.STARTED, end__lt=datetime.now() + timedelta(days=1)):
-            await self.reminder(t)
-
-        # schedule ending of the tests
-        for t in await NewGameTest.filter(status__not=TestStatus.STARTED, end__lt=datetime.now()):
-            await self.ender(t)
+        # (re)build the timers for all tests that still need a reminder or ending, anything that was missed while we
+        # were offline is in the past and fires right away
+        with Metrics.timed(Metrics.SCHEDULER_RUNS, task="rebuild"):
+            for test in await NewGameTest.filter(status__not=TestStatus.ENDED,
+                                                 game__guild__in=Guilds.served(self.bot)):
+                self.schedule_test(test)
+
+    def schedule_test(self, test):
+        if test.status == TestStatus.STARTED:
+            self.timers.schedule(test.id, test.end - timedelta(days=1))
+        elif test.status == TestStatus.ENDING:
+            self.timers.schedule(test.id, test.end)
+        else:
+            self.timers.cancel(test.id)
 
-    async def delayer(self, delay, todo):
-        await asyncio.sleep(delay)
-        await todo
+    async def handle_deadline(self, test_id):
+        with Metrics.timed(Metrics.SCHEDULER_RUNS, task="deadline"):
+            await self.run_deadline(test_id)
 
-    @with_role_ping()
-    async def reminder(self, test):
-        channel = self.bot.get_channel(Configuration.get_var("announcement_channel"))
-        await channel.send(
-            f"<@&{Configuration.get_var('tester_role')}> Only 24 hours remaining before this test ends. Please make sure to get your feedback before then if you have not already! https://canary.discordapp.com/channels/{channel.guild.id}/{channel.id}/{test.message}")
-        test.status = TestStatus.ENDING
-        await test.save()
+    async def run_deadline(self, test_id):
+        test = await NewGameTest.get_or_none(id=test_id)
+        if test is None or test.status == TestStatus.ENDED:
+            return
+        now = datetime.now()
+        if test.end <= now:
+            await self.ender(test)
+            return
+        if test.status == TestStatus.STARTED and test.end - timedelta(days=1) <= now:
+            # rescheduled once the reminder went out
+            self.queue_reminder(test)
+            return
+        self.schedule_test(test)
+
+    def queue_reminder(self, test):
+        self.due_reminders[test.id] = test
+        if self.reminder_batch is None:
+            self.reminder_batch = self.bot.loop.create_task(self.send_reminders())
+
+    async def send_reminders(self):
+        # give the scheduler a moment to find all other tests that are due as well
+        await asyncio.sleep(REMINDER_BATCH_DELAY)
+        tests = list(self.due_reminders.values())
+        self.due_reminders.clear()
+        self.reminder_batch = None
+        try:
+            with Metrics.timed(Metrics.SCHEDULER_RUNS, task="reminders"):
+                await self.reminder(tests)
+        except Exception as ex:
+            await Utils.handle_exception("Sending reminders failed", self.bot, ex)
+            for test in tests:
+                self.timers.schedule(test.id, datetime.now() + RETRY_DELAY)
+        else:
+            for test in tests:
+                self.schedule_test(test)
+
+    async def reminder(self, tests):
+        links = defaultdict(list)
+        for test in tests:
+            config = await self.test_config(test)
+            links[config.guild].append(
+                f"https://canary.discordapp.com/channels/{config.guild}/{config.announcement_channel}/{test.message}")
+        # the outbox takes care of making the role mentionable while posting, once per announcement
+        async with in_transaction():
+            for guild_id, guild_links in links.items():
+                config = Guilds.get(guild_id)
+                for start in range(0, len(guild_links), REMINDERS_PER_MESSAGE):
+                    batch = guild_links[start:start + REMINDERS_PER_MESSAGE]
+                    if len(batch) == 1:
+                        content = f"<@&{config.tester_role}> Only 24 hours remaining before this test ends. Please make sure to get your feedback before then if you have not already! {batch[0]}"
+                    else:
+                        content = f"<@&{config.tester_role}> Only 24 hours remaining before these tests end. Please make sure to get your feedback before then if you have not already!\n" + "\n".join(batch)
+                    await Outbox.announcement(config, content)
+            await NewGameTest.filter(id__in=[test.id for test in tests]).update(status=TestStatus.ENDING)
+        for test in tests:
+            test.status = TestStatus.ENDING
+            self.announcements[test.message] = test.status
+            Cache.invalidate_test(test)
+        self.outbox.wake()
 
-    @atomic()
     async def ender(self, test):
-        # edit message to say this test is completed
-        channel = self.bot.get_channel(Configuration.get_var("announcement_channel"))
-        message = await channel.fetch_message(test.message)
-        await message.edit(content=f"~~{message.content}~~\n**This test has ended**")
-        # mark as completed in the database
-        test.status = TestStatus.ENDED
-        await test.save()
+        # edit message to say this test is completed, older tests don't have their content stored
+        config = await self.test_config(test)
+        if test.content is None:
+            channel, _ = Guilds.resolve(self.bot, config)
+            test.content = (await channel.fetch_message(test.message)).content
+        await self.bot.http.edit_message(config.announcement_channel, test.message,
+                                         content=f"~~{test.content}~~\n**This test has ended**")
         if test.feedback is not None:
             # find all users who filled in the feedback
-            sheet = SheetUtils.get_sheet(test.feedback)
-            user_ids = sheet.col_values(2)[1:]
-            await Completion.bulk_create([Completion(test=test, user=u) for u in user_ids])
-            await self._test_report(self.bot.get_user(Configuration.get_var("admin_id")), test)
+            # pick up whatever was submitted since the last sync
+            await self.sync_feedback(test)
+            admin = self.bot.get_user(config.admin_id) or await self.bot.fetch_user(config.admin_id)
+            await self._test_report(admin, test)
+        # mark as completed in the database last, if anything above failed the scheduler retries the whole thing
+        test.status = TestStatus.ENDED
+        await test.save()
+        self.announcements[test.message] = test.status
+        Cache.invalidate_test(test)
+
+    @tasks.loop(minutes=5)
+    async def feedback_sync_loop(self):
+        with Metrics.timed(Metrics.SCHEDULER_RUNS, task="feedback_sync"):
+            for test in await NewGameTest.filter(status__not=TestStatus.ENDED, feedback__not_isnull=True,
+                                                 game__guild__in=Guilds.served(self.bot)):
+                try:
+                    await self.sync_feedback(test)
+                except Exception as ex:
+                    await Utils.handle_exception("Feedback sync failed", self.bot, ex, test=test)
+
+    @commands.Cog.listener()
+    async def on_config_reloaded(self, old, new):
+        if old.feedback_sync_minutes != new.feedback_sync_minutes:
+            self.feedback_sync_loop.change_interval(minutes=new.feedback_sync_minutes)
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild):
+        # channels and roles are new objects after an outage
+        Guilds.forget(guild.id)
+
+    @commands.command()
+    async def reload_config(self, ctx):
+        # the config file belongs to the whole install, guild admins don't get to reload it
+        if ctx.author.id != Configuration.CONFIG.admin_id:
+            return
+        await ctx.send(await self.bot.reload_config())
+
+    @feedback_sync_loop.before_loop
+    async def before_feedback_sync(self):
+        await self.announcements_loaded.wait()
+
+    async def sync_feedback(self, test):
+        async with self.feedback_locks[test.id]:
+            state = await FeedbackSync.get_or_none(test=test.id)
+            if state is None:
+                state = FeedbackSync(test=test.id)
+            # user ids are in the second column, the first row holds the headers
+            user_ids = await SheetUtils.col_values_from(test.feedback, 2, state.rows + 2)
+            if len(user_ids) == 0:
+                return
+            async with in_transaction():
+                for start in range(0, len(user_ids), FEEDBACK_BATCH_SIZE):
+                    # anything that isn't a user id would fail the insert and block the sync (and ending the test)
+                    batch = [int(u) for u in user_ids[start:start + FEEDBACK_BATCH_SIZE] if str(u).strip().isnumeric()]
+                    if len(batch) > 0:
+                        await Completion.bulk_create([Completion(test_id=test.id, user=u) for u in batch])
+                        await Activity.record_feedback(test, batch)
+                # move the cursor in the same transaction so rows are never ingested twice
+                state.rows += len(user_ids)
+                await state.save()
 
     @commands.command()
     async def test_report(self, ctx, test: TestConverter):
+        if test.status != TestStatus.ENDED and test.feedback is not None:
+            await self.sync_feedback(test)
         await self._test_report(ctx, test)
 
     async def _test_report(self, channel, test):
-        await test.fetch_related("completions")
-        # sort by amount submitted
-        counts = {k: v for k, v in
-                  sorted(Counter([c.user for c in test.completions]).items(), key=lambda item: item[1])}
+        # everyone who claimed a code in this test with how often they submitted feedback, sorted by amount submitted
+        rows = await Database.fetch(
+            'SELECT c."claimed_by" AS "user", c."code" AS "code", COUNT(f."id") AS "submissions" FROM "gamecode" c '
+            'LEFT JOIN "completion" f ON f."test_id" = c."claimed_in_id" AND f."user" = c."claimed_by" '
+            'WHERE c."claimed_in_id" = ? GROUP BY c."code", c."claimed_by" ORDER BY "submissions"', [test.id])
 
-        # fetch their keys
-        keys = dict()
-        for code in await GameCode.filter(claimed_in=test):
-            keys[code.claimed_by] = code.code
+        config = await self.test_config(test)
+        names = await Members.usernames(self.bot, config.guild, [row["user"] for row in rows])
 
         # report codes and feedback counts for all users
         buffer = StringIO()
         writer = csv.writer(buffer, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
         writer.writerow(["User id", "username", "Code", "Submitted feedback x times"])
 
-        for user_id, key in keys.items():
-            writer.writerow([f"\t{user_id}", str(self.bot.get_user(user_id)), key, counts.get(user_id, 0)])
+        for row in rows:
+            writer.writerow([f"\t{row['user']}", names[row['user']], row["code"], row["submissions"]])
 
         buffer.seek(0)
         file = discord.File(buffer, "Test report.csv")
@@ -255,45 +559,46 @@ class GameTesting(Cog):
 
     @commands.command()
     async def game_codes(self, ctx, game: GameConverter):
-        # fetch used codes
-        codes = await GameCode.filter(game=game).prefetch_related("claimed_in")
-        # create buffer, don't bother saving to disk
-        buffer = StringIO()
-        writer = csv.writer(buffer, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        # write codes to the writer
-        writer.writerow(["Code", "claimed by", "claimed by username", "claimed in test"])
-        for c in codes:
-            writer.writerow(
-                [c.code, f"\t{c.claimed_by}", str(self.bot.get_user(c.claimed_by)) if c.claimed_by is not None else "",
-                 (str(c.claimed_in.id) if c.claimed_in is not None else "")])
-        buffer.seek(0)
-        file = discord.File(buffer, f"codes for {game.name}.csv")
-        await ctx.send(file=file)
+        export = CsvExport(f"codes for {game.name}", ["Code", "claimed by", "claimed by username", "claimed in test"])
+        # page through the codes with a keyset cursor so we never hold more than a page in memory
+        last = ""
+        while True:
+            page = await GameCode.filter(game=game, code__gt=last).order_by("code").limit(EXPORT_PAGE_SIZE) \
+                .values_list("code", "claimed_by", "claimed_in_id")
+            if len(page) == 0:
+                break
+            last = page[-1][0]
+            names = await Members.usernames(self.bot, game.guild, [row[1] for row in page if row[1] is not None])
+            export.writerows(
+                [code, f"\t{claimed_by}", names[claimed_by] if claimed_by is not None else "",
+                 str(claimed_in) if claimed_in is not None else ""] for code, claimed_by, claimed_in in page)
+        for file in await export.files(Export.get_limit(ctx)):
+            await ctx.send(file=file)
 
     @commands.command()
-    async def inactive_report(self, ctx, count: int = 3):
-        await self._report(ctx, count)
-
-    async def _report(self, channel, count):
-        announcement_channel = self.bot.get_channel(Configuration.get_var("announcement_channel"))
-        # everyone who filled in feedback for the last 3 tests
-        feedback_providers = set(
-            c.user for test in await NewGameTest.filter().order_by("-end").limit(count).prefetch_related("completions") for
-            c in test.completions)
+    async def inactive_report(self, ctx, count: int = 3, game: Optional[GameConverter] = None):
+        config = await self.guild_config(ctx)
+        if config is None:
+            return
+        await self._report(ctx, config, count, game)
+
+    async def _report(self, channel, config, count, game=None):
+        # everyone who filled in feedback for the last x tests
+        feedback_providers = await Activity.active_users(count, config.guild, game)
         # all testers
-        testers = set(
-            m.id for m in announcement_channel.guild.get_role(Configuration.get_var("tester_role")).members)
+        testers = await Members.role_members(self.bot.get_guild(config.guild), config.tester_role)
         # report those who didn't contribute
         slackers = testers - feedback_providers
+        names = await Members.usernames(self.bot, config.guild, slackers)
 
         buffer = StringIO()
         writer = csv.writer(buffer, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
         writer.writerow(["User id", "Username"])
         # write codes to the writer
         for s in slackers:
-            writer.writerow([f"\t{s}", str(self.bot.get_user(s))])
+            writer.writerow([f"\t{s}", names[s]])
         buffer.seek(0)
-        file = discord.File(buffer, f"did not participate in last {count} tests.csv")
+        file = discord.File(buffer, f"did not participate in last {count}{f' {game}' if game is not None else ''} tests.csv")
         await channel.send(file=file)
 
 
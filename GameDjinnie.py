@@ -1,33 +1,36 @@
+import signal
+
+from discord import Intents, MemberCacheFlags
 from discord.ext import commands
-from discord.ext.commands import Bot
-from tortoise import Tortoise
+from discord.ext.commands import AutoShardedBot
 
-from Utils import Logging, Configuration, Utils, Emoji
-from Utils.Models import NewGameTest, GameTest
+from Utils import Logging, Configuration, Utils, Emoji, Database, Migrations, Metrics, Guilds, CodeAllocator
+from Utils.LoopMonitor import LoopMonitor
 
 
-class GameJinnie(Bot):
+class GameJinnie(AutoShardedBot):
     loaded = False
 
     async def on_ready(self):
         if not self.loaded:
-            Logging.BOT_LOG_CHANNEL = self.get_channel(Configuration.get_var("log_channel"))
+            # the log channel can be on a shard another process is handling
+            log_channel = Configuration.CONFIG.log_channel
+            Logging.BOT_LOG_CHANNEL = self.get_channel(log_channel) or await self.fetch_channel(log_channel)
             Emoji.initialize(self)
+            Metrics.instrument_http(self.http)
+            self.loop_monitor = LoopMonitor(self)
+            self.loop.create_task(Utils.report_errors())
+            if hasattr(signal, "SIGHUP"):
+                self.loop.add_signal_handler(signal.SIGHUP, lambda: self.loop.create_task(self.reload_config()))
 
             Logging.info("Connected to discord!")
 
             Logging.info("Establishing database connections")
-            await Tortoise.init(
-                db_url="sqlite://db.sqlite3",
-                modules={"models": ["Utils.Models"]}
-            )
-            await Tortoise.generate_schemas()
+            await Database.init()
+            await Migrations.run()
+            await Guilds.load(self)
+            await CodeAllocator.report_available()
             Logging.info("Database connected")
-            if await NewGameTest.filter().first() is None:
-                to_insert = list()
-                for test in await GameTest.all().prefetch_related("game"):
-                    to_insert.append(NewGameTest(game=test.game, message=test.message, end=test.end, status=test.status, feedback=test.feedback))
-                await NewGameTest.bulk_create(to_insert)
             Logging.info("Loading cogs")
             for cog in ["GameTesting"]:
                 try:
@@ -35,10 +38,37 @@ class GameJinnie(Bot):
                 except Exception as e:
                     await Utils.handle_exception(f"Failed to load cog {cog}", self, e)
             Logging.info("Cogs loaded")
+            await Metrics.start()
 
             await Logging.bot_log("GameDjinnie ready to go!")
             self.loaded = True
 
+    async def reload_config(self):
+        # everything is checked before swapping, a broken file leaves the running config alone
+        old = Configuration.CONFIG
+        try:
+            new = Configuration.read()
+            log_channel = Logging.BOT_LOG_CHANNEL
+            if new.log_channel != old.log_channel:
+                log_channel = self.get_channel(new.log_channel) or await self.fetch_channel(new.log_channel)
+        except Exception as ex:
+            Logging.error(f"Failed to reload the config: {ex}")
+            return f"{Emoji.get_chat_emoji('NO')} Failed to reload the config, still using the old one: {ex}"
+        Configuration.CONFIG = new
+        Logging.BOT_LOG_CHANNEL = log_channel
+        changed = old.changed(new)
+        if "emoji" in changed:
+            Emoji.initialize(self)
+        if any(name in changed for name in ["announcement_channel", "tester_role", "admin_id", "reaction_emoji"]):
+            await Guilds.store_configured(self, overwrite=True)
+        self.dispatch("config_reloaded", old, new)
+        message = f"Config reloaded, changed: {', '.join(changed) or 'nothing'}"
+        restart = [name for name in changed if name in Configuration.RESTART_REQUIRED]
+        if len(restart) > 0:
+            message += f"\n{Emoji.get_chat_emoji('WARNING')} These only take effect after a restart: {', '.join(restart)}"
+        Logging.info(message)
+        return message
+
     async def on_command_error(bot, ctx: commands.Context, error):
         if isinstance(error, commands.BotMissingPermissions):
             await ctx.send(error)
@@ -73,7 +103,24 @@ if __name__ == '__main__':
     Configuration.load()
     Logging.info("Did someone summon the GameDjinnie?")
 
-    bot = GameJinnie(command_prefix=Configuration.get_var("prefix"), case_insensitive=True)
-    bot.run(Configuration.get_var("token"))
+    options = dict()
+    if Configuration.CONFIG.low_memory:
+        # only what the bot uses, members are looked up when needed instead of keeping every member of every guild
+        # in memory (still needs the members intent for those lookups)
+        intents = Intents.none()
+        intents.guilds = True
+        intents.members = True
+        intents.emojis = True
+        intents.guild_messages = True
+        intents.guild_reactions = True
+        intents.dm_messages = True
+        options = dict(intents=intents, member_cache_flags=MemberCacheFlags.none(), chunk_guilds_at_startup=False,
+                       max_messages=None)
+
+    # without shard settings discord tells us how many shards to use and this process runs all of them
+    bot = GameJinnie(command_prefix=Configuration.CONFIG.prefix, case_insensitive=True,
+                     shard_count=Configuration.CONFIG.shard_count,
+                     shard_ids=Configuration.CONFIG.shard_ids, **options)
+    bot.run(Configuration.CONFIG.token)
 
     Logging.info("GameDjinnie shutdown")
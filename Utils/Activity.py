@@ -0,0 +1,92 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from Utils import Database
+from Utils.Models import Participation, NewGameTest
+
+# how many test ids to remember per user and game
+RECENT_TESTS = 10
+BATCH_SIZE = 500
+
+
+def add_recent(recent_tests, test_id):
+    tests = [t for t in recent_tests.split(",") if t != "" and t != str(test_id)]
+    return ",".join([str(test_id)] + tests[:RECENT_TESTS - 1])
+
+
+async def record_feedback(test, user_ids):
+    # to be called in the same transaction that stores the completions
+    now = datetime.now()
+    counts = Counter(int(u) for u in user_ids if str(u).strip().isnumeric())
+    users = list(counts.keys())
+    for start in range(0, len(users), BATCH_SIZE):
+        batch = users[start:start + BATCH_SIZE]
+        existing = {p.user: p for p in await Participation.filter(game_id=test.game_id, user__in=batch)}
+        to_create = list()
+        for user in batch:
+            participation = existing.get(user)
+            if participation is None:
+                to_create.append(Participation(user=user, game_id=test.game_id, last_test_end=test.end,
+                                               last_feedback=now, recent_tests=str(test.id),
+                                               submissions=counts[user]))
+            else:
+                participation.last_test_end = max(participation.last_test_end, test.end)
+                participation.last_feedback = now
+                participation.recent_tests = add_recent(participation.recent_tests, test.id)
+                participation.submissions += counts[user]
+                await participation.save()
+        if len(to_create) > 0:
+            await Participation.bulk_create(to_create)
+
+
+async def test_moved(test):
+    # the latest test end of everyone who gave feedback for this test, now that it moved (to be called after saving)
+    latest = defaultdict(list)
+    for row in await Database.fetch(
+            'SELECT f."user" AS "user", MAX(t."end") AS "end" FROM "completion" f '
+            'JOIN "newgametest" t ON t."id" = f."test_id" '
+            'WHERE t."game_id" = ? AND f."user" IN (SELECT "user" FROM "completion" WHERE "test_id" = ?) '
+            'GROUP BY f."user"', [test.game_id, test.id]):
+        latest[Database.to_datetime(row["end"])].append(row["user"])
+    # most people end up with the same end, one update per distinct end
+    for end, users in latest.items():
+        for start in range(0, len(users), BATCH_SIZE):
+            await Participation.filter(game_id=test.game_id, user__in=users[start:start + BATCH_SIZE]) \
+                .update(last_test_end=end)
+
+
+async def active_users(count, guild_id, game=None):
+    # everyone who gave feedback for any of the last x tests in this guild (of this game)
+    tests = NewGameTest.filter(game=game) if game is not None else NewGameTest.filter(game__guild=guild_id)
+    ends = await tests.order_by("-end").limit(count).values_list("end", flat=True)
+    if len(ends) == 0:
+        return set()
+    participation = Participation.filter(last_test_end__gte=ends[-1])
+    if game is not None:
+        participation = participation.filter(game=game)
+    else:
+        participation = participation.filter(game__guild=guild_id)
+    return set(await participation.values_list("user", flat=True))
+
+
+async def rebuild():
+    # (re)builds the index from all completions, safe to run again if it gets interrupted
+    await Participation.all().delete()
+    index = dict()
+    for row in await Database.fetch(
+            'SELECT f."user" AS "user", t."game_id" AS "game", t."id" AS "test", t."end" AS "end", '
+            'COUNT(f."id") AS "submissions" FROM "completion" f JOIN "newgametest" t ON t."id" = f."test_id" '
+            'GROUP BY f."user", t."game_id", t."id", t."end" ORDER BY t."end"'):
+        # older syncs stored whatever was in the sheet
+        if not str(row["user"]).strip().isnumeric():
+            continue
+        key = (int(row["user"]), row["game"])
+        participation = index.get(key)
+        if participation is None:
+            participation = index[key] = Participation(user=key[0], game_id=key[1], submissions=0)
+        participation.last_test_end = participation.last_feedback = Database.to_datetime(row["end"])
+        participation.recent_tests = add_recent(participation.recent_tests or "", row["test"])
+        participation.submissions += row["submissions"]
+    to_create = list(index.values())
+    for start in range(0, len(to_create), BATCH_SIZE):
+        await Participation.bulk_create(to_create[start:start + BATCH_SIZE])
@@ -0,0 +1,97 @@
+import time
+
+from tortoise.query_utils import Q
+
+from Utils import Configuration
+from Utils.Models import Game, NewGameTest
+
+# (kind, value) -> (model, expires at), every model is stored under each of its lookup keys
+GAMES = dict()
+TESTS = dict()
+# url -> (url, expires at), for sheets we know are shared with us and not used for a test yet
+SHEETS = dict()
+
+
+def expiry():
+    # entries also expire by themselves so changes made outside this process get picked up eventually
+    return time.monotonic() + Configuration.CONFIG.cache_minutes * 60
+
+
+def lookup(cache, keys):
+    now = time.monotonic()
+    for key in keys:
+        entry = cache.get(key)
+        if entry is None:
+            continue
+        if entry[1] > now:
+            return entry[0]
+        del cache[key]
+    return None
+
+
+def game_keys(arg, guild_id):
+    # names are only unique within a guild, outside of one only the id can be looked up directly
+    keys = [("name", guild_id, arg)] if guild_id is not None else []
+    return keys + ([("id", int(arg))] if arg.isnumeric() else [])
+
+
+def put_game(game):
+    GAMES[("name", game.guild, game.name)] = GAMES[("id", game.id)] = (game, expiry())
+
+
+async def get_game(arg, guild_id=None):
+    game = lookup(GAMES, game_keys(arg, guild_id))
+    if game is None:
+        query = Game.filter(Q(name=arg, id=int(arg) if arg.isnumeric() else 0, join_type="OR"))
+        if guild_id is not None:
+            query = query.filter(guild=guild_id)
+        games = await query
+        # an id wins over a name, a name shared by games of different guilds is no answer
+        matches = [g for g in games if str(g.id) == arg] or games
+        game = matches[0] if len(matches) == 1 else None
+        if game is not None:
+            put_game(game)
+    return game
+
+
+async def get_game_by_id(game_id):
+    game = lookup(GAMES, [("id", game_id)])
+    if game is None:
+        game = await Game.get_or_none(id=game_id)
+        if game is not None:
+            put_game(game)
+    return game
+
+
+def test_keys(arg):
+    return [("id", int(arg)), ("message", int(arg))] if arg.isnumeric() else []
+
+
+def put_test(test):
+    TESTS[("id", test.id)] = TESTS[("message", test.message)] = (test, expiry())
+
+
+def invalidate_test(test):
+    TESTS.pop(("id", test.id), None)
+    TESTS.pop(("message", test.message), None)
+
+
+async def get_test(arg):
+    test = lookup(TESTS, test_keys(arg))
+    if test is None:
+        test = await NewGameTest.get_or_none(Q(id=arg, message=int(arg) if arg.isnumeric() else 0, join_type="OR"))
+        if test is not None:
+            put_test(test)
+    return test
+
+
+def sheet_validated(url):
+    return lookup(SHEETS, [url]) is not None
+
+
+def put_sheet(url):
+    SHEETS[url] = (url, time.monotonic() + Configuration.CONFIG.sheet_cache_minutes * 60)
+
+
+def sheet_used(url):
+    SHEETS.pop(url, None)
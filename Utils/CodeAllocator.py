@@ -0,0 +1,89 @@
+import asyncio
+from collections import deque
+
+from Utils import Database, Metrics
+from Utils.Models import GameCode
+
+# how many unclaimed codes to pull from the database at once when a pool runs dry
+BATCH_SIZE = 100
+
+POOLS = dict()
+
+
+# hands out the unclaimed codes of a single game, one claim at a time
+class CodePool:
+    def __init__(self, game_id):
+        self.game_id = game_id
+        self.lock = asyncio.Lock()
+        self.buffer = deque()
+        self.available = None
+
+    def set_available(self, available):
+        self.available = available
+        Metrics.CODES_AVAILABLE.set(available, game=self.game_id)
+
+    async def count(self):
+        self.set_available(await GameCode.filter(game_id=self.game_id, claimed_by=None).count())
+
+    async def claim(self, user_id, test_id):
+        async with self.lock:
+            if self.available is None:
+                await self.count()
+            while self.available > 0:
+                if len(self.buffer) == 0:
+                    self.buffer.extend(await GameCode.filter(game_id=self.game_id, claimed_by=None)
+                                       .limit(BATCH_SIZE).values_list("code", flat=True))
+                    if len(self.buffer) == 0:
+                        self.set_available(0)
+                        break
+                code = self.buffer.popleft()
+                self.set_available(self.available - 1)
+                # all claims for this game go through the lock so this only misses when a code was removed or
+                # claimed outside of this pool in the meantime, the guard makes sure it is never handed out twice
+                updated = await GameCode.filter(code=code, claimed_by=None).update(claimed_by=user_id,
+                                                                                    claimed_in_id=test_id)
+                if updated == 1:
+                    return code, self.available
+            return None, 0
+
+    async def release(self, code):
+        async with self.lock:
+            if self.available is not None:
+                self.set_available(self.available + 1)
+                self.buffer.append(code)
+
+    async def reset(self):
+        async with self.lock:
+            self.buffer.clear()
+            # counted right away to keep the metric up to date
+            await self.count()
+
+
+def get_pool(game_id):
+    if game_id not in POOLS:
+        POOLS[game_id] = CodePool(game_id)
+    return POOLS[game_id]
+
+
+# claims a code for this user, returns the code (or None if there are none left) and how many remain
+async def claim(game_id, user_id, test_id):
+    return await get_pool(game_id).claim(user_id, test_id)
+
+
+# puts a code that was freed up again back in the pool
+async def release(game_id, code):
+    if game_id in POOLS:
+        await POOLS[game_id].release(code)
+
+
+# forget what we know about this game's codes, to be called after codes are added or removed
+async def reset(game_id):
+    await get_pool(game_id).reset()
+
+
+# the metric for every game at once, the pools keep it up to date from there
+async def report_available():
+    for row in await Database.fetch(
+            'SELECT g."id" AS "game", COUNT(c."code") AS "codes" FROM "game" g '
+            'LEFT JOIN "gamecode" c ON c."game_id" = g."id" AND c."claimed_by" IS NULL GROUP BY g."id"'):
+        Metrics.CODES_AVAILABLE.set(row["codes"], game=row["game"])
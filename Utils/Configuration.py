@@ -1,14 +1,95 @@
 import yaml
 
-CONFIG = {}
+MISSING = object()
 
-def load():
-    global CONFIG
-    with open("config.yaml", encoding="UTF8") as file:
-        CONFIG = yaml.load(file, Loader=yaml.FullLoader)
 
+class ConfigError(Exception):
+    pass
+
+
+# name -> (type, default), MISSING for the ones that are required
+FIELDS = {
+    "token": (str, MISSING),
+    "prefix": (str, MISSING),
+    "log_channel": (int, MISSING),
+    "admin_id": (int, MISSING),
+    "emoji": (dict, dict()),
+    "announcement_channel": (int, None),
+    "tester_role": (int, None),
+    "reaction_emoji": (str, None),
+    "claim_workers": (int, 4),
+    "claim_queue_size": (int, 1000),
+    "sheets_workers": (int, 4),
+    "sheets_timeout": (float, 20),
+    "sheets_retries": (int, 3),
+    "feedback_sync_minutes": (float, 5),
+    "database": (dict, dict()),
+    "metrics_port": (int, None),
+    "metrics_host": (str, "127.0.0.1"),
+    "loop_stall_threshold": (float, 1.0),
+    "loop_stall_report_minutes": (float, 10),
+    "error_digest_minutes": (float, 5),
+    "cache_minutes": (float, 10),
+    "sheet_cache_minutes": (float, 60),
+    "outbox_workers": (int, 5),
+    "scheduler_concurrency": (int, 4),
+    "low_memory": (bool, False),
+    "username_cache_size": (int, 10000),
+    "shard_count": (int, None),
+    "shard_ids": (list, None),
+}
+
+# only read when starting up, changing these needs a restart
+RESTART_REQUIRED = ["token", "prefix", "claim_workers", "claim_queue_size", "sheets_workers", "database",
+                    "metrics_port", "metrics_host", "loop_stall_threshold", "loop_stall_report_minutes",
+                    "outbox_workers", "scheduler_concurrency", "low_memory", "shard_count", "shard_ids"]
+
+
+def matches(value, kind):
+    if kind is float:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if kind is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, kind)
+
+
+# validated snapshot of the config file, never changed after creation. Reloading builds a new one and swaps it in
+class Config:
+    def __init__(self, values):
+        if not isinstance(values, dict):
+            raise ConfigError("The config file should contain a mapping of settings")
+        problems = list()
+        for name, (kind, default) in FIELDS.items():
+            value = values.get(name, default)
+            if value is MISSING:
+                problems.append(f"{name} is missing")
+            elif value is not None and not matches(value, kind):
+                problems.append(f"{name} should be {kind.__name__}, not {value!r}")
+            object.__setattr__(self, name, value)
+        if len(problems) > 0:
+            raise ConfigError("Invalid config: " + ", ".join(problems))
+        object.__setattr__(self, "values", values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Config snapshots can't be changed, load a new one instead")
+
+    def changed(self, other):
+        return [name for name in FIELDS if getattr(self, name) != getattr(other, name)]
+
+
+CONFIG = None
+
+
+def read(values=None):
+    # builds a snapshot without making it the current one
+    if values is None:
+        with open("config.yaml", encoding="UTF8") as file:
+            values = yaml.load(file, Loader=yaml.FullLoader)
+    return Config(values)
+
+
+def load(values=None):
+    global CONFIG
+    CONFIG = read(values)
+    return CONFIG
 
-def get_var(key):
-    if key in CONFIG:
-        return CONFIG.get(key)
-    raise KeyError(f"Missing config key in the config file: {key}")
\ No newline at end of file
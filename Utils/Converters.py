@@ -3,23 +3,25 @@ from datetime import datetime
 from discord.ext import commands
 from discord.ext.commands import BadArgument
 from gspread import SpreadsheetNotFound
-from tortoise.exceptions import DoesNotExist
-
 from parser import ParserError
 
 from dateutil.parser import parse
-from tortoise.query_utils import Q
 
-from Utils import SheetUtils
-from Utils.Models import Game, GameTest, NewGameTest
+from Utils import SheetUtils, Cache
+from Utils.Models import NewGameTest
+
+
+def in_guild(ctx, guild_id):
+    # outside of servers (the admin from the config file in DMs) everything is in reach
+    return ctx.guild is None or guild_id == ctx.guild.id
 
 
 class GameConverter(commands.Converter):
     async def convert(self, ctx, arg):
-        try:
-            return await Game.get(Q(name=arg, id=int(arg) if arg.isnumeric() else 0, join_type="OR"))
-        except DoesNotExist:
+        game = await Cache.get_game(arg, ctx.guild.id if ctx.guild is not None else None)
+        if game is None or not in_guild(ctx, game.guild):
             raise BadArgument("Unknown game")
+        return game
 
 
 def dateConverter(arg) -> datetime:
@@ -35,20 +37,23 @@ def dateConverter(arg) -> datetime:
 
 class TestConverter(commands.Converter):
     async def convert(self, ctx, argument):
-        try:
-            return await NewGameTest.get(Q(id=argument, message=int(argument) if argument.isnumeric() else 0, join_type="OR"))
-        except DoesNotExist:
+        test = await Cache.get_test(argument)
+        if test is None or not in_guild(ctx, (await Cache.get_game_by_id(test.game_id)).guild):
             raise BadArgument("Unknown test")
+        return test
 
 
 class Sheetconverter(commands.Converter):
     async def convert(self, ctx, argument):
+        if Cache.sheet_validated(argument):
+            return argument
         # make sure it wasn't used already
         if await NewGameTest.get_or_none(feedback=argument) is not None:
             raise BadArgument("This sheet was already used for a previous test!")
         try:
-            SheetUtils.get_sheet(argument)
+            await SheetUtils.get_sheet(argument, refresh=True)
         except SpreadsheetNotFound:
             raise BadArgument("Invalid link, please make sure it is shared with the bot email")
         else:
+            Cache.put_sheet(argument)
             return argument
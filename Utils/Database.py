@@ -0,0 +1,163 @@
+from datetime import datetime
+
+from tortoise import Tortoise
+
+from Utils import Configuration, Logging, Metrics
+
+# name -> (table, columns), matching the code claim, export, scheduler and report lookups
+INDEXES = {
+    "gamecode_game_claimed_by": ("gamecode", ["game_id", "claimed_by"]),
+    "gamecode_game_code": ("gamecode", ["game_id", "code"]),
+    "gamecode_claimed_in": ("gamecode", ["claimed_in_id", "claimed_by"]),
+    "newgametest_status_end": ("newgametest", ["status", "end"]),
+    "completion_test_user": ("completion", ["test_id", "user"]),
+    "participation_game_last_test": ("participation", ["game_id", "last_test_end"]),
+    "participation_last_test": ("participation", ["last_test_end"]),
+    "outbox_next_attempt": ("outbox", ["next_attempt"]),
+    "outbox_guild_next_attempt": ("outbox", ["guild", "next_attempt"]),
+    "game_guild": ("game", ["guild"]),
+}
+
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    # safe with WAL, we only risk the last transactions on power loss, not corruption
+    "PRAGMA synchronous=NORMAL",
+    # in KiB when negative
+    "PRAGMA cache_size=-{cache_size}",
+    "PRAGMA busy_timeout={busy_timeout}",
+]
+
+
+def get_url():
+    database = Configuration.CONFIG.database
+    url = database.get("url", "sqlite://db.sqlite3")
+    if not url.startswith("sqlite") and "pool_size" in database:
+        url += f"{'&' if '?' in url else '?'}maxsize={database['pool_size']}"
+    return url
+
+
+def get_dialect():
+    return Tortoise.get_connection("default").capabilities.dialect
+
+
+def quote(name):
+    return f"`{name}`" if get_dialect() == "mysql" else f'"{name}"'
+
+
+def translate(query):
+    # queries are written with ? placeholders and "quoted" identifiers, adjust those for the database in use
+    dialect = get_dialect()
+    if dialect == "mysql":
+        return query.replace("?", "%s").replace('"', "`")
+    if dialect == "postgres":
+        parts = query.split("?")
+        return parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], start=1))
+    return query
+
+
+async def fetch(query, values=None):
+    result = await Tortoise.get_connection("default").execute_query(translate(query), values)
+    # newer tortoise versions return the affected row count together with the rows
+    rows = result[1] if isinstance(result, tuple) else result
+    return [dict(row) for row in rows]
+
+
+async def columns(table):
+    if get_dialect() == "sqlite":
+        return [row["name"] for row in await fetch(f"PRAGMA table_info({quote(table)})")]
+    schema = "DATABASE()" if get_dialect() == "mysql" else "current_schema()"
+    rows = await fetch(f'SELECT column_name AS "name" FROM information_schema.columns '
+                       f'WHERE table_schema = {schema} AND table_name = ?', [table])
+    return [row["name"] for row in rows]
+
+
+async def foreign_keys(table):
+    # column -> (constraint name, table it points at)
+    dialect = get_dialect()
+    if dialect == "sqlite":
+        # sqlite constraints don't have names
+        return {row["from"]: (None, row["table"]) for row in await fetch(f"PRAGMA foreign_key_list({quote(table)})")}
+    if dialect == "mysql":
+        rows = await fetch(
+            'SELECT column_name AS "column", constraint_name AS "name", referenced_table_name AS "referenced" '
+            'FROM information_schema.key_column_usage '
+            'WHERE table_schema = DATABASE() AND table_name = ? AND referenced_table_name IS NOT NULL', [table])
+    else:
+        rows = await fetch(
+            'SELECT k."column_name" AS "column", c."constraint_name" AS "name", r."table_name" AS "referenced" '
+            'FROM information_schema.table_constraints c '
+            'JOIN information_schema.key_column_usage k '
+            'ON k."constraint_name" = c."constraint_name" AND k."table_schema" = c."table_schema" '
+            'JOIN information_schema.constraint_column_usage r '
+            'ON r."constraint_name" = c."constraint_name" AND r."table_schema" = c."table_schema" '
+            'WHERE c."constraint_type" = \'FOREIGN KEY\' AND c."table_schema" = current_schema() AND c."table_name" = ?',
+            [table])
+    return {row["column"]: (row["name"], row["referenced"]) for row in rows}
+
+
+async def unique_constraints(table):
+    # constraint or index name -> its columns, for the unique ones besides the primary key
+    dialect = get_dialect()
+    constraints = dict()
+    if dialect == "sqlite":
+        for index in await fetch(f"PRAGMA index_list({quote(table)})"):
+            if index["unique"] and index["origin"] != "pk":
+                columns = await fetch(f"PRAGMA index_info({quote(index['name'])})")
+                constraints[index["name"]] = [c["name"] for c in sorted(columns, key=lambda c: c["seqno"])]
+        return constraints
+    if dialect == "mysql":
+        rows = await fetch(
+            'SELECT index_name AS "name", column_name AS "column" FROM information_schema.statistics '
+            'WHERE table_schema = DATABASE() AND table_name = ? AND non_unique = 0 AND index_name != \'PRIMARY\' '
+            'ORDER BY index_name, seq_in_index', [table])
+    else:
+        rows = await fetch(
+            'SELECT c."constraint_name" AS "name", k."column_name" AS "column" '
+            'FROM information_schema.table_constraints c '
+            'JOIN information_schema.key_column_usage k '
+            'ON k."constraint_name" = c."constraint_name" AND k."table_schema" = c."table_schema" '
+            'WHERE c."constraint_type" = \'UNIQUE\' AND c."table_schema" = current_schema() AND c."table_name" = ? '
+            'ORDER BY c."constraint_name", k."ordinal_position"', [table])
+    for row in rows:
+        constraints.setdefault(row["name"], list()).append(row["column"])
+    return constraints
+
+
+def to_datetime(value):
+    # sqlite hands back raw query results as text
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+async def init():
+    url = get_url()
+    await Tortoise.init(
+        db_url=url,
+        modules={"models": ["Utils.Models"]}
+    )
+    Metrics.instrument_database(Tortoise.get_connection("default"))
+    if get_dialect() == "sqlite":
+        database = Configuration.CONFIG.database
+        await Tortoise.get_connection("default").execute_script(";\n".join(SQLITE_PRAGMAS).format(
+            cache_size=database.get("cache_size_kb", 65536),
+            busy_timeout=database.get("busy_timeout_ms", 5000)
+        ))
+
+
+async def create_indexes(names=None):
+    # table creation doesn't add indexes to tables that already exist, so these are managed separately
+    dialect = get_dialect()
+    for name, (table, columns) in INDEXES.items():
+        if names is not None and name not in names:
+            continue
+        if dialect == "mysql":
+            existing = await fetch(
+                "SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = ? AND index_name = ?",
+                [table, name])
+            if len(existing) > 0:
+                continue
+            statement = "CREATE INDEX"
+        else:
+            statement = "CREATE INDEX IF NOT EXISTS"
+        await Tortoise.get_connection("default").execute_script(
+            f"{statement} {quote(name)} ON {quote(table)} ({', '.join(quote(c) for c in columns)})")
+        Logging.debug(f"Ensured index {name} on {table}")
@@ -30,7 +30,8 @@ BACKUPS = {
 
 
 def initialize(bot):
-    for name, eid in Configuration.get_var("emoji").items():
+    EMOJI.clear()
+    for name, eid in Configuration.CONFIG.emoji.items():
         EMOJI[name] = utils.get(bot.emojis, id=eid)
 
 
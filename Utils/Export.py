@@ -0,0 +1,71 @@
+import asyncio
+import csv
+import gzip
+import io
+import tempfile
+
+import discord
+
+# discord's upload limit when we can't ask the guild for it
+DEFAULT_LIMIT = 8 * 1024 * 1024
+# room for gzip's internal buffer and the multipart overhead when deciding to start a new part
+MARGIN = 0.1
+
+
+# csv export that is written to a temporary file as it goes, so memory use doesn't grow with the amount of rows
+class CsvExport:
+    def __init__(self, name, header):
+        self.name = name
+        self.file = tempfile.TemporaryFile()
+        self.text = io.TextIOWrapper(self.file, encoding="utf-8", newline="")
+        self.writer = csv.writer(self.text, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        self.writer.writerow(header)
+
+    def writerows(self, rows):
+        self.writer.writerows(rows)
+
+    def split(self, limit):
+        # gzip the export into as many parts as needed to stay under the limit, each part is a complete csv on its own
+        parts = list()
+        part = None
+        compressed = None
+        header = None
+        self.file.seek(0)
+        for line in self.file:
+            if header is None:
+                header = line
+                continue
+            if part is None or part.tell() + len(line) > limit * (1 - MARGIN):
+                if compressed is not None:
+                    compressed.close()
+                part = tempfile.TemporaryFile()
+                parts.append(part)
+                compressed = gzip.GzipFile(fileobj=part, mode="wb")
+                compressed.write(header)
+            compressed.write(line)
+        if compressed is not None:
+            compressed.close()
+        return parts
+
+    async def files(self, limit=DEFAULT_LIMIT):
+        self.text.flush()
+        if self.file.tell() <= limit * (1 - MARGIN):
+            self.text.detach()
+            self.file.seek(0)
+            return [discord.File(self.file, f"{self.name}.csv")]
+        # compressing can take a moment for big exports, keep it off the event loop
+        parts = await asyncio.get_event_loop().run_in_executor(None, self.split, limit)
+        self.close()
+        files = list()
+        for i, part in enumerate(parts, start=1):
+            part.seek(0)
+            suffix = f" part {i} of {len(parts)}" if len(parts) > 1 else ""
+            files.append(discord.File(part, f"{self.name}{suffix}.csv.gz"))
+        return files
+
+    def close(self):
+        self.text.close()
+
+
+def get_limit(ctx):
+    return ctx.guild.filesize_limit if ctx.guild is not None else DEFAULT_LIMIT
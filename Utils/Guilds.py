@@ -0,0 +1,68 @@
+from Utils import Configuration, Logging
+from Utils.Models import GuildConfig, Game, Outbox
+
+# guild id -> GuildConfig for every guild that is set up for testing
+CONFIGS = dict()
+# guild id -> (announcement channel, tester role), looked up once instead of on every use
+RESOLVED = dict()
+
+
+async def store_configured(bot, overwrite=False):
+    # the guild from the config file keeps working like before, it gets stored the first time we see it
+    channel_id = Configuration.CONFIG.announcement_channel
+    channel = bot.get_channel(channel_id) if channel_id is not None else None
+    if channel is None:
+        return None
+    values = dict(announcement_channel=channel_id, tester_role=Configuration.CONFIG.tester_role,
+                  admin_id=Configuration.CONFIG.admin_id, reaction_emoji=Configuration.CONFIG.reaction_emoji)
+    config = await GuildConfig.get_or_none(guild=channel.guild.id)
+    if config is None:
+        config = await GuildConfig.create(guild=channel.guild.id, **values)
+        Logging.info(f"Stored the configured guild {config.guild}")
+    elif overwrite:
+        for name, value in values.items():
+            setattr(config, name, value)
+        await config.save()
+    put(config)
+    return config.guild
+
+
+async def load(bot):
+    CONFIGS.clear()
+    RESOLVED.clear()
+    for config in await GuildConfig.all():
+        CONFIGS[config.guild] = config
+    guild_id = await store_configured(bot)
+    if guild_id is not None:
+        # everything from before games were tied to a guild belongs to this one
+        await Game.filter(guild=None).update(guild=guild_id)
+        await Outbox.filter(guild=None).update(guild=guild_id)
+
+
+def get(guild_id):
+    return CONFIGS.get(guild_id)
+
+
+def put(config):
+    CONFIGS[config.guild] = config
+    forget(config.guild)
+
+
+def forget(guild_id):
+    RESOLVED.pop(guild_id, None)
+
+
+def resolve(bot, config):
+    resolved = RESOLVED.get(config.guild)
+    if resolved is None or resolved[0] is None or resolved[1] is None:
+        guild = bot.get_guild(config.guild)
+        if guild is None:
+            return None, None
+        resolved = RESOLVED[config.guild] = (guild.get_channel(config.announcement_channel),
+                                             guild.get_role(config.tester_role))
+    return resolved
+
+
+def served(bot):
+    # when the shards are spread over multiple processes, every process only handles the guilds it is connected to
+    return [guild.id for guild in bot.guilds if guild.id in CONFIGS]
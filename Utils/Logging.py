@@ -1,13 +1,49 @@
+import asyncio
+import atexit
 import logging
 import os
+import queue
 import sys
-from logging.handlers import TimedRotatingFileHandler
+import time
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 
 LOGGER = logging.getLogger('gamedjinnie')
 DISCORD_LOGGER = logging.getLogger('discord')
 BOT_LOG_CHANNEL = None
 
 
+class LazyQueueHandler(QueueHandler):
+    # the listener lives in the same process, hand it the record as is so formatting (and building big dumps)
+    # happens on the listener thread instead of the event loop
+    def prepare(self, record):
+        return record
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def take(self):
+        while not self.try_take():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# discord allows 5 messages per 5 seconds per channel, stay well under that so the log channel never gets us limited
+BOT_LOG_BUCKET = TokenBucket(rate=0.5, capacity=5)
+
+
 def init():
     LOGGER.setLevel(logging.DEBUG)
 
@@ -15,23 +51,34 @@ def init():
 
     formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s')
 
-    handler = logging.StreamHandler(stream=sys.stdout)
-    handler.setLevel(logging.INFO)
-    handler.setFormatter(formatter)
-    LOGGER.addHandler(handler)
-    DISCORD_LOGGER.addHandler(handler)
+    stream_handler = logging.StreamHandler(stream=sys.stdout)
+    stream_handler.setLevel(logging.INFO)
+    stream_handler.setFormatter(formatter)
 
     if not os.path.isdir("logs"):
         os.mkdir("logs")
-    handler = TimedRotatingFileHandler(filename='logs/GameDjinnie.log', encoding='utf-8', when="midnight",
-                                       backupCount=30)
-    handler.setFormatter(formatter)
+    file_handler = TimedRotatingFileHandler(filename='logs/GameDjinnie.log', encoding='utf-8', when="midnight",
+                                            backupCount=30)
+    file_handler.setFormatter(formatter)
+    file_handler.setLevel(logging.INFO)
+
+    # writing happens on a separate thread, the event loop only puts records on the queue
+    log_queue = queue.Queue()
+    handler = LazyQueueHandler(log_queue)
     handler.setLevel(logging.INFO)
-    DISCORD_LOGGER.addHandler(handler)
     LOGGER.addHandler(handler)
+    DISCORD_LOGGER.addHandler(handler)
+    listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
 
-async def bot_log(message=None, embed=None):
+async def bot_log(message=None, embed=None, wait=True):
+    # without wait the message is dropped (and None returned) when it doesn't fit in the rate limit right now
+    if wait:
+        await BOT_LOG_BUCKET.take()
+    elif not BOT_LOG_BUCKET.try_take():
+        return None
     return await BOT_LOG_CHANNEL.send(content=message, embed=embed)
 
 
@@ -0,0 +1,70 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+from Utils import Configuration, Logging, Metrics
+
+HEARTBEAT_INTERVAL = 0.1
+
+
+# a heartbeat on the event loop measures how late it gets scheduled, a watchdog thread grabs the loop's stack while
+# the heartbeat is overdue so we can see what is blocking it
+class LoopMonitor:
+    def __init__(self, bot):
+        self.bot = bot
+        self.threshold = Configuration.CONFIG.loop_stall_threshold
+        self.report_interval = Configuration.CONFIG.loop_stall_report_minutes * 60
+        self.loop_thread = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        # stack of the stall currently in progress, filled by the watchdog
+        self.stall_stack = None
+        self.last_report = None
+        self.suppressed = 0
+        self.running = True
+        self.heartbeat_task = bot.loop.create_task(self.heartbeat())
+        self.watchdog_thread = threading.Thread(target=self.watchdog, name="loop watchdog", daemon=True)
+        self.watchdog_thread.start()
+
+    async def heartbeat(self):
+        while True:
+            expected = time.perf_counter() + HEARTBEAT_INTERVAL
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            now = time.perf_counter()
+            lag = max(0, now - expected)
+            self.last_beat = now
+            Metrics.LOOP_LAG.observe(lag)
+            if self.stall_stack is not None:
+                stack, self.stall_stack = self.stall_stack, None
+                try:
+                    await self.report(lag, stack)
+                except Exception as ex:
+                    # don't let a failing log channel take the monitor down with it
+                    Logging.error(f"Failed to report event loop stall: {ex}")
+
+    def watchdog(self):
+        while self.running:
+            time.sleep(self.threshold / 2)
+            if self.stall_stack is None and time.perf_counter() - self.last_beat > self.threshold + HEARTBEAT_INTERVAL:
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is not None:
+                    self.stall_stack = "".join(traceback.format_stack(frame))
+
+    async def report(self, lag, stack):
+        Metrics.LOOP_STALLS.inc()
+        now = time.monotonic()
+        if self.last_report is not None and now - self.last_report < self.report_interval:
+            self.suppressed += 1
+            return
+        self.last_report = now
+        suppressed = f" ({self.suppressed} more stalls since the last report)" if self.suppressed > 0 else ""
+        self.suppressed = 0
+        Logging.warn(f"Event loop was blocked for {lag:.2f}s{suppressed}, it was stuck in:\n{stack}")
+        # discord only takes 2000 characters, the innermost frames are the interesting ones
+        await Logging.bot_log(f"Event loop was blocked for {lag:.2f}s{suppressed}, it was stuck in:"
+                              f"```\n{stack[-1800:]}\n```")
+
+    def stop(self):
+        self.running = False
+        self.heartbeat_task.cancel()
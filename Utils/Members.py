@@ -0,0 +1,53 @@
+from collections import OrderedDict
+
+from Utils import Configuration
+
+# most ids query_members takes at once
+QUERY_SIZE = 100
+# user id -> username, least recently used first
+USERNAMES = OrderedDict()
+
+
+async def role_members(guild, role_id):
+    # without a member cache (low memory mode) page through the member list instead of keeping it around
+    if guild.chunked:
+        return set(m.id for m in guild.get_role(role_id).members)
+    members = set()
+    async for member in guild.fetch_members(limit=None):
+        if any(role.id == role_id for role in member.roles):
+            members.add(member.id)
+    return members
+
+
+def remember(user_id, name):
+    USERNAMES[user_id] = name
+    USERNAMES.move_to_end(user_id)
+    while len(USERNAMES) > Configuration.CONFIG.username_cache_size:
+        USERNAMES.popitem(last=False)
+
+
+async def usernames(bot, guild_id, user_ids):
+    # user id -> username, anything we don't know yet is asked for in as few gateway requests as possible
+    names = dict()
+    missing = list()
+    for user_id in set(user_ids):
+        if user_id in USERNAMES:
+            USERNAMES.move_to_end(user_id)
+            names[user_id] = USERNAMES[user_id]
+            continue
+        user = bot.get_user(user_id)
+        if user is not None:
+            names[user_id] = str(user)
+        else:
+            missing.append(user_id)
+    guild = bot.get_guild(guild_id)
+    if guild is not None:
+        for start in range(0, len(missing), QUERY_SIZE):
+            batch = missing[start:start + QUERY_SIZE]
+            for member in await guild.query_members(user_ids=batch, limit=len(batch), cache=False):
+                names[member.id] = str(member)
+    for user_id in missing:
+        # people who left show up the same as they always did
+        names.setdefault(user_id, "None")
+        remember(user_id, names[user_id])
+    return names
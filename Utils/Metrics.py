@@ -0,0 +1,195 @@
+import logging
+import re
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from aiohttp import web
+from discord import HTTPException
+
+from Utils import Configuration, Logging
+
+REGISTRY = list()
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = list(labels)
+        self.values = dict()
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, format_labels(self.labels, key), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {value}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, description, labels=(), collector=None):
+        super().__init__(name, description, labels)
+        # optional function returning {label values: value}, for things we'd rather read when scraped
+        self.collector = collector
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+    def samples(self):
+        if self.collector is not None:
+            self.values = self.collector()
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        if key not in self.values:
+            self.values[key] = ([0] * len(self.buckets), [0, 0])
+        counts, totals = self.values[key]
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                counts[i] += 1
+        totals[0] += 1
+        totals[1] += value
+
+    def samples(self):
+        for key, (counts, (count, total)) in self.values.items():
+            for bucket, bucket_count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", format_labels(self.labels, key, [("le", bucket)]), bucket_count
+            yield f"{self.name}_bucket", format_labels(self.labels, key, [("le", "+Inf")]), count
+            yield f"{self.name}_count", format_labels(self.labels, key), count
+            yield f"{self.name}_sum", format_labels(self.labels, key), total
+
+
+@contextmanager
+def timed(histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+COMMAND_LATENCY = Histogram("gamedjinnie_command_seconds", "Time it took to run a command", ["command"])
+CLAIMS = Counter("gamedjinnie_code_claims_total", "Outcomes of code claims", ["outcome"])
+CLAIM_LATENCY = Histogram("gamedjinnie_claim_seconds", "Time it took to handle a code claim")
+DB_QUERIES = Histogram("gamedjinnie_db_query_seconds", "Database query timings", ["operation", "table"])
+SCHEDULER_RUNS = Histogram("gamedjinnie_scheduler_seconds", "Time it took to run scheduled work", ["task"])
+DISCORD_REQUESTS = Counter("gamedjinnie_discord_requests_total", "Discord REST calls", ["method", "route", "status"])
+DISCORD_RATE_LIMITS = Counter("gamedjinnie_discord_rate_limits_total", "Discord 429 responses", ["route"])
+LOOP_LAG = Histogram("gamedjinnie_loop_lag_seconds", "How late the event loop got to scheduled work",
+                     buckets=[0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10])
+LOOP_STALLS = Counter("gamedjinnie_loop_stalls_total", "Times the event loop was blocked past the stall threshold")
+OUTBOX_DELIVERIES = Counter("gamedjinnie_outbox_deliveries_total", "Outbox delivery attempts", ["kind", "result"])
+CLAIM_QUEUE_DEPTH = Gauge("gamedjinnie_claim_queue_depth", "Reactions waiting to be processed")
+CODES_AVAILABLE = Gauge("gamedjinnie_codes_available", "Unclaimed codes per game", ["game"])
+
+QUERY_PATTERN = re.compile(r'^\s*(\w+).*?\b(?:FROM|INTO|UPDATE|TABLE)\s+[`"]?(\w+)', re.IGNORECASE | re.DOTALL)
+
+
+def instrument_database(connection):
+    # wrap the query methods on the client class so queries made inside transactions are timed as well
+    client_class = type(connection)
+    if getattr(client_class, "_gamedjinnie_timed", False):
+        return
+    for method in ["execute_query", "execute_insert", "execute_many", "execute_script"]:
+        setattr(client_class, method, time_queries(getattr(client_class, method)))
+    client_class._gamedjinnie_timed = True
+
+
+def time_queries(func):
+    @wraps(func)
+    async def wrapped(self, query, *args, **kwargs):
+        match = QUERY_PATTERN.match(query)
+        operation, table = (match.group(1).upper(), match.group(2).lower()) if match else ("OTHER", "")
+        with timed(DB_QUERIES, operation=operation, table=table):
+            return await func(self, query, *args, **kwargs)
+
+    return wrapped
+
+
+def instrument_http(http):
+    request = http.request
+
+    @wraps(request)
+    async def wrapped(route, *args, **kwargs):
+        try:
+            result = await request(route, *args, **kwargs)
+        except HTTPException as ex:
+            DISCORD_REQUESTS.inc(method=route.method, route=route.path, status=ex.status)
+            raise
+        DISCORD_REQUESTS.inc(method=route.method, route=route.path, status="ok")
+        return result
+
+    http.request = wrapped
+    logging.getLogger("discord.http").addHandler(RateLimitCounter())
+
+
+class RateLimitCounter(logging.Handler):
+    # discord.py retries 429s by itself and only tells us through its log
+    def emit(self, record):
+        if not isinstance(record.msg, str):
+            return
+        if record.msg.startswith("We are being rate limited"):
+            # buckets look like <channel id>:<guild id>:<route>
+            DISCORD_RATE_LIMITS.inc(route=str(record.args[1]).split(":", 2)[-1])
+        elif record.msg.startswith("Global rate limit"):
+            DISCORD_RATE_LIMITS.inc(route="global")
+
+
+def render():
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+async def serve(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start():
+    port = Configuration.CONFIG.metrics_port
+    if port is None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", serve)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, Configuration.CONFIG.metrics_host, port).start()
+    Logging.info(f"Serving metrics on port {port}")
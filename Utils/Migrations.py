@@ -0,0 +1,151 @@
+from tortoise import Tortoise
+from tortoise.exceptions import OperationalError
+from tortoise.transactions import in_transaction
+from tortoise.utils import get_schema_sql
+
+from Utils import Logging, Database, Activity
+from Utils.Models import GameTest, NewGameTest, SchemaVersion
+
+BATCH_SIZE = 500
+
+
+async def create_tables():
+    # only creates tables that don't exist yet
+    await Tortoise.generate_schemas(safe=True)
+
+
+async def copy_game_tests():
+    # copies in batches, anything that was copied before an interruption is skipped when running again
+    last_id = 0
+    while True:
+        batch = await GameTest.filter(id__gt=last_id).order_by("id").limit(BATCH_SIZE)
+        if len(batch) == 0:
+            return
+        last_id = batch[-1].id
+        existing = set(
+            await NewGameTest.filter(message__in=[t.message for t in batch]).values_list("message", flat=True))
+        to_insert = [[t.game_id, t.message, t.end, int(t.status), t.feedback] for t in batch if t.message not in existing]
+        if len(to_insert) > 0:
+            # only the columns the table had at this point, later steps add the rest
+            async with in_transaction() as connection:
+                await connection.execute_many(Database.translate(
+                    'INSERT INTO "newgametest" ("game_id", "message", "end", "status", "feedback") '
+                    'VALUES (?, ?, ?, ?, ?)'), to_insert)
+        Logging.info(f"Copied {len(to_insert)} tests (up to id {last_id})")
+
+
+def indexes(*names):
+    # only the given ones, the others might be on tables or columns a later step adds
+    async def migration():
+        await Database.create_indexes(names)
+
+    return migration
+
+
+def add_column(table, column, definition):
+    async def migration():
+        # databases created after the column was added to the model already have it
+        if column not in await Database.columns(table):
+            await Tortoise.get_connection("default").execute_script(
+                f"ALTER TABLE {Database.quote(table)} ADD COLUMN {Database.quote(column)} {definition}")
+
+    return migration
+
+
+async def rebuild_table(table):
+    # sqlite can't change constraints in place, create the table the way the model describes it now and copy over
+    statements = get_schema_sql(Tortoise.get_connection("default"), safe=False).split(";")
+    create = next(s for s in statements if s.strip().startswith(f'CREATE TABLE "{table}"'))
+    columns = ", ".join(Database.quote(c) for c in await Database.columns(table))
+    # dropping a table other tables point at would cascade into them, and this can't be changed inside a transaction
+    await Tortoise.get_connection("default").execute_script("PRAGMA foreign_keys=OFF")
+    try:
+        async with in_transaction() as connection:
+            await connection.execute_query(create.replace(f'"{table}"', f'"{table}_new"', 1))
+            await connection.execute_query(f'INSERT INTO "{table}_new" ({columns}) SELECT {columns} FROM "{table}"')
+            await connection.execute_query(f'DROP TABLE "{table}"')
+            await connection.execute_query(f'ALTER TABLE "{table}_new" RENAME TO "{table}"')
+    finally:
+        await Tortoise.get_connection("default").execute_script("PRAGMA foreign_keys=ON")
+    # the indexes went with the old table
+    await Database.create_indexes([name for name, (t, _) in Database.INDEXES.items() if t == table])
+
+
+def point_at_new_tests(table, column, dangling):
+    async def migration():
+        name, referenced = (await Database.foreign_keys(table)).get(column, (None, None))
+        if referenced == "newgametest":
+            # created after the model was fixed
+            return
+        # these always held ids from the new tests table, only the constraint pointed at the old one
+        await Database.fetch(f'{dangling} WHERE "{column}" NOT IN (SELECT "id" FROM "newgametest")')
+        if Database.get_dialect() == "sqlite":
+            await rebuild_table(table)
+            return
+        drop = "DROP FOREIGN KEY" if Database.get_dialect() == "mysql" else "DROP CONSTRAINT"
+        await Database.fetch(f'ALTER TABLE "{table}" {drop} "{name}"')
+        await Database.fetch(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" FOREIGN KEY ("{column}") '
+                             f'REFERENCES "newgametest" ("id") ON DELETE CASCADE')
+
+    return migration
+
+
+async def game_names_per_guild():
+    constraints = await Database.unique_constraints("game")
+    if ["guild", "name"] in [sorted(columns) for columns in constraints.values()]:
+        # created after the model was changed
+        return
+    if Database.get_dialect() == "sqlite":
+        await rebuild_table("game")
+        return
+    name = next(name for name, columns in constraints.items() if columns == ["name"])
+    drop = "DROP INDEX" if Database.get_dialect() == "mysql" else "DROP CONSTRAINT"
+    await Database.fetch(f'ALTER TABLE "game" {drop} "{name}"')
+    await Database.fetch('ALTER TABLE "game" ADD CONSTRAINT "game_name_guild" UNIQUE ("name", "guild")')
+
+
+# never change or remove steps once released, only add new ones at the end
+MIGRATIONS = [
+    (1, "Create tables", create_tables),
+    (2, "Copy tests into the new tests table", copy_game_tests),
+    (3, "Add hot path indexes",
+     indexes("gamecode_game_claimed_by", "gamecode_claimed_in", "newgametest_status_end", "completion_test_user")),
+    (4, "Add code export index", indexes("gamecode_game_code")),
+    (5, "Create participation table", create_tables),
+    (6, "Build participation index", Activity.rebuild),
+    (7, "Add participation indexes", indexes("participation_game_last_test", "participation_last_test")),
+    (8, "Create outbox table", create_tables),
+    (9, "Add outbox index", indexes("outbox_next_attempt")),
+    (10, "Store announcement content", add_column("newgametest", "content", "TEXT")),
+    (11, "Create guild config table", create_tables),
+    (12, "Tie games to guilds", add_column("game", "guild", "BIGINT")),
+    (13, "Tie outbox messages to guilds", add_column("outbox", "guild", "BIGINT")),
+    (14, "Add guild indexes", indexes("outbox_guild_next_attempt", "game_guild")),
+    (15, "Point claimed codes at the new tests table",
+     point_at_new_tests("gamecode", "claimed_in_id", 'UPDATE "gamecode" SET "claimed_in_id" = NULL')),
+    (16, "Point completions at the new tests table",
+     point_at_new_tests("completion", "test_id", 'DELETE FROM "completion"')),
+    (17, "Make game names unique per guild instead of overall", game_names_per_guild),
+]
+
+
+async def get_version():
+    try:
+        latest = await SchemaVersion.all().order_by("-version").first()
+    except OperationalError:
+        # no version table yet, this database predates migrations
+        return 0
+    return latest.version if latest is not None else 0
+
+
+async def run():
+    version = await get_version()
+    pending = [m for m in MIGRATIONS if m[0] > version]
+    if len(pending) == 0:
+        Logging.info(f"Database schema is up to date (version {version})")
+        return
+    for number, description, migration in pending:
+        Logging.info(f"Running database migration {number}: {description}")
+        await migration()
+        await SchemaVersion.create(version=number)
+    Logging.info(f"Database migrated from version {version} to {pending[-1][0]}")
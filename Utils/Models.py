@@ -12,7 +12,12 @@ class TestStatus(IntEnum):
 
 class Game(Model):
     id = fields.IntField(pk=True)
-    name = fields.CharField(max_length=50, unique=True)
+    name = fields.CharField(max_length=50)
+    guild = fields.BigIntField(null=True)
+
+    class Meta:
+        # every guild names its own games
+        unique_together = (("name", "guild"),)
 
     def __str__(self):
         return self.name
@@ -22,7 +27,7 @@ class GameCode(Model):
     code = fields.CharField(pk=True, max_length=50)
     claimed_by = fields.BigIntField(null=True)
     game = fields.ForeignKeyField("models.Game", related_name="codes")
-    claimed_in = fields.ForeignKeyField("models.GameTest", related_name="codes", null=True)
+    claimed_in = fields.ForeignKeyField("models.NewGameTest", related_name="codes", null=True)
 
     def __str__(self):
         return self.code
@@ -44,6 +49,8 @@ class NewGameTest(Model):
     end = fields.DatetimeField()
     status = fields.IntEnumField(TestStatus, default=TestStatus.STARTED)
     feedback = fields.CharField(max_length=150, null=True)
+    # content of the announcement, so it can be edited without fetching it first
+    content = fields.TextField(null=True)
 
     def __str__(self):
         return f"Test {self.game}-{self.message}: {TestStatus._value2member_map_[self.status]} (end at {self.end})"
@@ -51,5 +58,60 @@ class NewGameTest(Model):
 
 class Completion(Model):
     id = fields.IntField(pk=True)
-    test = fields.ForeignKeyField("models.GameTest", related_name="completions")
+    test = fields.ForeignKeyField("models.NewGameTest", related_name="completions")
     user = fields.BigIntField()
+
+
+class FeedbackSync(Model):
+    # how many rows of a test's feedback sheet have been turned into completions already
+    test = fields.IntField(pk=True)
+    rows = fields.IntField(default=0)
+
+
+class SchemaVersion(Model):
+    version = fields.IntField(pk=True)
+    applied = fields.DatetimeField(auto_now_add=True)
+
+
+class Participation(Model):
+    # per user and game, kept up to date as feedback comes in so inactivity reports don't need to scan completions
+    id = fields.IntField(pk=True)
+    user = fields.BigIntField()
+    game = fields.ForeignKeyField("models.Game", related_name="participation")
+    last_test_end = fields.DatetimeField()
+    last_feedback = fields.DatetimeField()
+    # comma separated ids of the last tests they gave feedback for, most recent first
+    recent_tests = fields.CharField(max_length=255, default="")
+    submissions = fields.IntField(default=0)
+
+    class Meta:
+        unique_together = (("user", "game"),)
+
+
+class Outbox(Model):
+    # messages waiting to be sent, written in the same transaction as whatever caused them so none get lost
+    id = fields.IntField(pk=True)
+    # dm, admin or announcement
+    kind = fields.CharField(max_length=20)
+    # user or channel id
+    target = fields.BigIntField()
+    content = fields.TextField()
+    # claimed code this message delivers, given back if it can't be delivered
+    code = fields.CharField(max_length=50, null=True)
+    game = fields.IntField(null=True)
+    # reaction to remove when the user has their DMs closed
+    channel = fields.BigIntField(null=True)
+    message = fields.BigIntField(null=True)
+    emoji = fields.CharField(max_length=100, null=True)
+    attempts = fields.IntField(default=0)
+    next_attempt = fields.DatetimeField()
+    # only the process serving this guild sends it
+    guild = fields.BigIntField(null=True)
+
+
+class GuildConfig(Model):
+    guild = fields.BigIntField(pk=True)
+    announcement_channel = fields.BigIntField()
+    tester_role = fields.BigIntField()
+    admin_id = fields.BigIntField()
+    reaction_emoji = fields.CharField(max_length=100)
@@ -0,0 +1,189 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from aiohttp import ClientError
+from discord import Forbidden, NotFound, HTTPException
+
+from Utils import Logging, Utils, Metrics, CodeAllocator, Guilds
+from Utils.Models import Outbox, GameCode
+
+# how many due messages to pick up at once
+LOAD_SIZE = 100
+# look for retries that became due at least this often, new messages wake the sender up right away
+IDLE_CHECK = 60
+RETRY_DELAY = 5
+MAX_RETRY_DELAY = 3600
+MAX_ATTEMPTS = 10
+
+
+def reaction_key(emoji):
+    # the form discord expects in reaction routes
+    return emoji.name if emoji.id is None else f"{emoji.name}:{emoji.id}"
+
+
+# these only write to the outbox, call them inside the transaction that causes the message and wake the sender after
+async def dm(guild_id, user_id, content, payload=None, code=None, game_id=None):
+    reaction = dict()
+    if payload is not None:
+        reaction = dict(channel=payload.channel_id, message=payload.message_id, emoji=reaction_key(payload.emoji))
+    await Outbox.create(kind="dm", guild=guild_id, target=user_id, content=content, code=code, game=game_id,
+                        next_attempt=datetime.now(), **reaction)
+
+
+async def admin(config, content):
+    await Outbox.create(kind="admin", guild=config.guild, target=config.admin_id, content=content,
+                        next_attempt=datetime.now())
+
+
+async def announcement(config, content):
+    await Outbox.create(kind="announcement", guild=config.guild, target=config.announcement_channel,
+                        content=content, next_attempt=datetime.now())
+
+
+async def release_code(entry):
+    if entry.code is None:
+        return
+    # they never got it, give the code back so someone else can have it
+    freed = await GameCode.filter(code=entry.code, claimed_by=entry.target).update(claimed_by=None,
+                                                                                   claimed_in_id=None)
+    if freed == 1:
+        await CodeAllocator.release(entry.game, entry.code)
+
+
+# delivers what's in the outbox with a bounded amount of concurrent sends, backing off per target when discord or the
+# network gives us trouble
+class OutboxSender:
+    def __init__(self, bot, workers):
+        self.bot = bot
+        self.queue = asyncio.Queue()
+        self.in_flight = set()
+        # target -> when we can try sending to it again
+        self.blocked = dict()
+        self.wakeup = asyncio.Event()
+        self.tasks = [bot.loop.create_task(self.load())] + [bot.loop.create_task(self.worker()) for _ in
+                                                              range(workers)]
+
+    def wake(self):
+        self.wakeup.set()
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+    async def load(self):
+        while True:
+            self.wakeup.clear()
+            timeout = IDLE_CHECK
+            try:
+                due = await Outbox.filter(guild__in=Guilds.served(self.bot), next_attempt__lte=datetime.now()) \
+                    .order_by("id").limit(LOAD_SIZE)
+            except Exception as ex:
+                await Utils.handle_exception("Loading the outbox failed", self.bot, ex)
+                due = []
+            now = time.monotonic()
+            self.blocked = {target: until for target, until in self.blocked.items() if until > now}
+            for entry in due:
+                if entry.id in self.in_flight:
+                    continue
+                blocked_until = self.blocked.get(entry.target, 0)
+                if blocked_until > now:
+                    timeout = min(timeout, blocked_until - now)
+                    continue
+                self.in_flight.add(entry.id)
+                self.queue.put_nowait(entry)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def worker(self):
+        while True:
+            entry = await self.queue.get()
+            try:
+                await self.deliver(entry)
+            except Exception as ex:
+                await Utils.handle_exception("Outbox delivery failed", self.bot, ex, entry=entry)
+                try:
+                    await self.retry(entry, ex)
+                except Exception as ex:
+                    Logging.error(f"Failed to reschedule outbox message {entry.id}: {ex!r}")
+            finally:
+                self.in_flight.discard(entry.id)
+                if self.queue.empty():
+                    # there might be more waiting than we loaded last time
+                    self.wakeup.set()
+
+    async def deliver(self, entry):
+        try:
+            await self.send(entry)
+        except (Forbidden, NotFound):
+            await self.undeliverable(entry)
+            result = "undeliverable"
+        except HTTPException as ex:
+            if ex.status != 429 and ex.status < 500:
+                # asking again won't change the answer
+                Logging.error(f"Discord refused outbox message {entry.id} to {entry.target}: {ex}")
+                await self.undeliverable(entry)
+                result = "failed"
+            else:
+                await self.retry(entry, ex)
+                return
+        except (ClientError, asyncio.TimeoutError) as ex:
+            await self.retry(entry, ex)
+            return
+        else:
+            result = "sent"
+        Metrics.OUTBOX_DELIVERIES.inc(kind=entry.kind, result=result)
+        await entry.delete()
+
+    async def send(self, entry):
+        if entry.kind == "announcement":
+            channel, role = Guilds.resolve(self.bot, Guilds.get(entry.guild))
+            if channel is None or channel.id != entry.target:
+                # queued before the announcement channel changed
+                channel = self.bot.get_channel(entry.target)
+            await role.edit(mentionable=True)
+            # always make the role unmentionable again, even if sending failed
+            try:
+                await channel.send(entry.content)
+            finally:
+                await role.edit(mentionable=False)
+        else:
+            user = self.bot.get_user(entry.target) or await self.bot.fetch_user(entry.target)
+            await user.send(entry.content)
+
+    async def undeliverable(self, entry):
+        if entry.kind == "admin":
+            # admin has DMs closed, fall back to botlog
+            await Logging.bot_log(f"<@{entry.target}> {entry.content}")
+        elif entry.kind == "dm":
+            await release_code(entry)
+            if entry.message is not None:
+                # user has DMs closed, remove their reaction to indicate this
+                Metrics.CLAIMS.inc(outcome="dm_closed")
+                try:
+                    await self.bot.http.remove_reaction(entry.channel, entry.message, entry.emoji, entry.target)
+                except HTTPException as ex:
+                    Logging.warn(f"Failed to remove the reaction of {entry.target} on {entry.message}: {ex}")
+        else:
+            Logging.error(f"Failed to post announcement in {entry.target}: {entry.content}")
+
+    async def retry(self, entry, ex):
+        entry.attempts += 1
+        if entry.attempts >= MAX_ATTEMPTS:
+            Logging.error(f"Giving up on outbox message {entry.id} to {entry.target} after {entry.attempts} attempts: "
+                          f"{ex!r}")
+            Metrics.OUTBOX_DELIVERIES.inc(kind=entry.kind, result="failed")
+            await release_code(entry)
+            await entry.delete()
+            return
+        delay = min(RETRY_DELAY * 2 ** (entry.attempts - 1), MAX_RETRY_DELAY)
+        retry_after = getattr(getattr(ex, "response", None), "headers", {}).get("Retry-After")
+        if retry_after is not None:
+            delay = max(delay, float(retry_after))
+        # everything else for this target would run into the same problem
+        self.blocked[entry.target] = time.monotonic() + delay
+        entry.next_attempt = datetime.now() + timedelta(seconds=delay)
+        await entry.save()
+        Metrics.OUTBOX_DELIVERIES.inc(kind=entry.kind, result="retry")
@@ -0,0 +1,100 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+# sampling more often than this mostly measures the profiler itself
+DEFAULT_INTERVAL = 0.005
+ACTIVE = None
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame):
+    # root first, the format flamegraph.pl and speedscope expect
+    names = list()
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+# samples the event loop thread's stack from a separate thread and, while running, times every step of the
+# coroutines defined in the watched files. Nothing is hooked in when it's not running
+class Profiler:
+    def __init__(self, watched_files, interval=DEFAULT_INTERVAL):
+        self.watched_files = set(watched_files)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        # function -> [steps, seconds spent running on the loop]
+        self.timings = defaultdict(lambda: [0, 0.0])
+        self.started = dict()
+        self.running = False
+        self.thread = None
+        self.target = None
+
+    def start(self):
+        global ACTIVE
+        if ACTIVE is not None:
+            raise RuntimeError("A profiler is already running")
+        ACTIVE = self
+        self.running = True
+        self.target = threading.get_ident()
+        self.thread = threading.Thread(target=self.sample, name="profiler", daemon=True)
+        self.thread.start()
+        # only applies to the calling thread, which is the one running the event loop
+        sys.setprofile(self.profile)
+
+    def stop(self):
+        global ACTIVE
+        sys.setprofile(None)
+        self.running = False
+        self.thread.join()
+        ACTIVE = None
+
+    def sample(self):
+        while self.running:
+            frame = sys._current_frames().get(self.target)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def profile(self, frame, event, arg):
+        if frame.f_code.co_filename not in self.watched_files:
+            return
+        # coroutines trigger a call every time they are resumed and a return every time they suspend
+        if event == "call":
+            self.started[frame] = time.perf_counter()
+        elif event == "return":
+            started = self.started.pop(frame, None)
+            if started is not None:
+                timing = self.timings[frame_name(frame)]
+                timing[0] += 1
+                timing[1] += time.perf_counter() - started
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def summary(self, top):
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        lines = [f"{self.samples} samples every {self.interval * 1000:.0f}ms", "",
+                 f"Top {top} by own samples:"]
+        lines += [f"{count / max(self.samples, 1):7.1%} {name}" for name, count in own.most_common(top)]
+        lines += ["", f"Top {top} by total samples:"]
+        lines += [f"{count / max(self.samples, 1):7.1%} {name}" for name, count in total.most_common(top)]
+        lines += ["", f"Top {top} coroutines by time spent running on the event loop:"]
+        timings = sorted(self.timings.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        lines += [f"{seconds * 1000:10.1f}ms {steps:8} steps {name}" for name, (steps, seconds) in timings]
+        return "\n".join(lines) + "\n"
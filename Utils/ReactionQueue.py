@@ -0,0 +1,70 @@
+import asyncio
+import time
+from collections import deque
+
+from Utils import Utils, Metrics
+
+
+class ReactionQueue:
+    def __init__(self, bot, handler, workers, size):
+        self.bot = bot
+        self.handler = handler
+        self.queue = asyncio.Queue(maxsize=size)
+        # keys that are queued or being worked on, repeats of these are dropped
+        self.pending = set()
+        self.latencies = deque(maxlen=1000)
+        self.processed = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.workers = [bot.loop.create_task(self.worker()) for _ in range(workers)]
+
+    def put(self, key, payload):
+        # returns False when the queue is full and the payload was dropped
+        if key in self.pending:
+            self.coalesced += 1
+            return True
+        # every event runs in its own task, waiting for room would only pile those up instead
+        try:
+            self.queue.put_nowait((key, payload, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            Metrics.CLAIMS.inc(outcome="dropped")
+            return False
+        self.pending.add(key)
+        Metrics.CLAIM_QUEUE_DEPTH.set(self.queue.qsize())
+        return True
+
+    async def worker(self):
+        while True:
+            key, payload, queued = await self.queue.get()
+            Metrics.CLAIM_QUEUE_DEPTH.set(self.queue.qsize())
+            try:
+                await self.handler(payload)
+            except Exception as ex:
+                await Utils.handle_exception("Reaction processing failed", self.bot, ex, payload=payload)
+            finally:
+                self.pending.discard(key)
+                self.latencies.append(time.perf_counter() - queued)
+                self.processed += 1
+                self.queue.task_done()
+
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+
+    def percentile(self, percent):
+        if len(self.latencies) == 0:
+            return 0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+    def stats(self):
+        return {
+            "Queue depth": self.queue.qsize(),
+            "Workers": len(self.workers),
+            "Processed": self.processed,
+            "Coalesced duplicates": self.coalesced,
+            "Dropped (queue full)": self.dropped,
+            "Latency p50": f"{self.percentile(50) * 1000:.0f}ms",
+            "Latency p99": f"{self.percentile(99) * 1000:.0f}ms"
+        }
@@ -0,0 +1,69 @@
+import asyncio
+import heapq
+from datetime import datetime, timedelta
+
+from Utils import Utils
+
+# how long to wait before trying again when handling a deadline failed
+RETRY_DELAY = timedelta(minutes=10)
+# when a deadline comes up again while it's still being handled, look at it again after this
+BUSY_DELAY = timedelta(seconds=5)
+
+
+# keeps a single upcoming deadline per key and calls the handler with that key once it's due, handling up to
+# concurrency deadlines at the same time
+class Scheduler:
+    def __init__(self, bot, handler, concurrency=1):
+        self.bot = bot
+        self.handler = handler
+        self.heap = list()
+        self.deadlines = dict()
+        self.wakeup = asyncio.Event()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # keys being handled right now -> their task
+        self.active = dict()
+        self.task = bot.loop.create_task(self.run())
+
+    def schedule(self, key, when):
+        # replaced entries stay in the heap and get skipped once they surface
+        self.deadlines[key] = when
+        heapq.heappush(self.heap, (when, key))
+        self.wakeup.set()
+
+    def cancel(self, key):
+        self.deadlines.pop(key, None)
+
+    def stop(self):
+        self.task.cancel()
+        for task in self.active.values():
+            task.cancel()
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            while len(self.heap) > 0 and self.heap[0][0] <= datetime.now():
+                when, key = heapq.heappop(self.heap)
+                if self.deadlines.get(key) != when:
+                    continue
+                del self.deadlines[key]
+                if key in self.active:
+                    self.schedule(key, datetime.now() + BUSY_DELAY)
+                    continue
+                await self.semaphore.acquire()
+                self.active[key] = self.bot.loop.create_task(self.fire(key))
+            timeout = (self.heap[0][0] - datetime.now()).total_seconds() if len(self.heap) > 0 else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def fire(self, key):
+        try:
+            await self.handler(key)
+        except Exception as ex:
+            await Utils.handle_exception("Scheduled task failed", self.bot, ex, key=key)
+            if key not in self.deadlines:
+                self.schedule(key, datetime.now() + RETRY_DELAY)
+        finally:
+            del self.active[key]
+            self.semaphore.release()
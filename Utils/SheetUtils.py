@@ -1,10 +1,94 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import gspread
+import httplib2
+from gspread.exceptions import APIError
+from gspread.utils import rowcol_to_a1
 from oauth2client.service_account import ServiceAccountCredentials
+from requests import RequestException, Session
+
+from Utils import Configuration, Logging
+
+SCOPES = ['https://www.googleapis.com/auth/drive']
+# google answers these when it's overloaded or having a bad day, anything else won't improve by asking again
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+CLIENT = None
+CLIENT_LOCK = threading.Lock()
+EXECUTOR = None
+SHEETS = dict()
+
+
+# gives up on requests to google that hang, giving up in run alone leaves the sheets thread stuck on them
+class TimeoutSession(Session):
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", Configuration.CONFIG.sheets_timeout)
+        return super().request(method, url, **kwargs)
+
+
+def login(client):
+    # gspread refreshes the token without a timeout, do that part ourselves
+    client.auth.refresh(httplib2.Http(timeout=Configuration.CONFIG.sheets_timeout))
+    client.login()
+
+
+def get_client():
+    global CLIENT
+    with CLIENT_LOCK:
+        if CLIENT is None:
+            credentials = ServiceAccountCredentials.from_json_keyfile_name('client_secret.json', SCOPES)
+            client = gspread.Client(auth=credentials, session=TimeoutSession())
+            login(client)
+            CLIENT = client
+        elif CLIENT.auth.access_token_expired:
+            # credentials time out after a while, only refresh the token then and keep using the same http session
+            login(CLIENT)
+        return CLIENT
+
+
+def get_executor():
+    global EXECUTOR
+    if EXECUTOR is None:
+        EXECUTOR = ThreadPoolExecutor(max_workers=Configuration.CONFIG.sheets_workers,
+                                      thread_name_prefix="sheets")
+    return EXECUTOR
+
+
+def should_retry(ex):
+    if isinstance(ex, APIError):
+        return ex.response.status_code in RETRY_STATUSES
+    return isinstance(ex, (asyncio.TimeoutError, RequestException))
+
+
+async def run(func, *args):
+    # gspread is blocking, run it on the sheets threads so a slow google never holds up the event loop
+    loop = asyncio.get_event_loop()
+    timeout = Configuration.CONFIG.sheets_timeout
+    retries = Configuration.CONFIG.sheets_retries
+    for attempt in range(retries + 1):
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(get_executor(), lambda: func(get_client(), *args)),
+                                          timeout)
+        except Exception as ex:
+            if attempt == retries or not should_retry(ex):
+                raise
+            delay = 2 ** attempt
+            Logging.warn(f"Google sheets call failed ({ex!r}), retrying in {delay} seconds")
+            await asyncio.sleep(delay)
+
+
+async def get_sheet(url, refresh=False):
+    # refresh makes sure we (still) have access to it instead of trusting what we opened before
+    if refresh or url not in SHEETS:
+        SHEETS[url] = await run(lambda client: client.open_by_url(url).sheet1)
+    return SHEETS[url]
 
 
-def get_sheet(url):
-    # connect to google drive each time as credentials time out after a while of not using them
-    credentials = ServiceAccountCredentials.from_json_keyfile_name('client_secret.json',
-                                                                   ['https://www.googleapis.com/auth/drive'])
-    gc = gspread.authorize(credentials)
-    return gc.open_by_url(url).sheet1
+async def col_values_from(url, col, start):
+    # only fetch the part of the column from the start row onwards, empty cells come back as empty strings
+    sheet = await get_sheet(url)
+    column = rowcol_to_a1(1, col)[:-1]
+    result = await run(lambda client: sheet.spreadsheet.values_get(f"'{sheet.title}'!{column}{start}:{column}"))
+    return [row[0] if len(row) > 0 else "" for row in result.get("values", [])]
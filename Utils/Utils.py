@@ -1,19 +1,21 @@
+import asyncio
 import time
 import traceback
 from datetime import datetime
 from functools import wraps
 
+import aiohttp
 from aiohttp import ClientOSError, ServerDisconnectedError
 from discord import ConnectionClosed, Embed, Colour
 from discord.abc import PrivateChannel
 
-from Utils import Logging, Configuration
+from Utils import Logging, Configuration, Guilds
 
 
-def extract_info(o):
-    info = ""
+def snapshot(o):
+    # cheap copy of what extract_info shows, so it can be turned into text later on the logging thread
     if hasattr(o, "__dict__"):
-        info += str(o.__dict__)
+        return dict(o.__dict__)
     elif hasattr(o, "__slots__"):
         items = dict()
         for slot in o.__slots__:
@@ -21,108 +23,170 @@ def extract_info(o):
                 items[slot] = getattr(o, slot)
             except AttributeError:
                 pass
-        info += str(items)
+        return items
     else:
-        info += str(o) + " "
-    return info
+        return str(o) + " "
 
 
-async def handle_exception(exception_type, bot, exception, event=None, message=None, ctx=None, *args, **kwargs):
-    embed = Embed(colour=Colour(0xff0000), timestamp=datetime.utcfromtimestamp(time.time()))
+def extract_info(o):
+    return str(snapshot(o))
 
-    # something went wrong and it might have been in on_command_error, make sure we log to the log file first
-    lines = [
-        "\n===========================================EXCEPTION CAUGHT, DUMPING ALL AVAILABLE INFO===========================================",
-        f"Type: {exception_type}"
-    ]
 
-    arg_info = ""
-    for arg in list(args):
-        arg_info += extract_info(arg) + "\n"
-    if arg_info == "":
-        arg_info = "No arguments"
+class ExceptionDump:
+    # only gets turned into text when the log listener formats the record
+    def __init__(self, exception_type, exception, event, message, ctx, args, kwargs):
+        self.exception_type = exception_type
+        self.exception = exception
+        self.event = event
+        self.args = [snapshot(arg) for arg in args]
+        self.kwargs = {name: snapshot(arg) for name, arg in kwargs.items()}
+        self.content = message.content if message is not None and hasattr(message, "content") else None
+        self.message = snapshot(message) if self.content is not None else None
+        self.command = None
+        if ctx is not None:
+            self.command = (ctx.command.name, channel_name(ctx.channel), f"{str(ctx.author)} (`{ctx.author.id}`)")
+        self.text = None
 
-    kwarg_info = ""
-    for name, arg in kwargs.items():
-        kwarg_info += "{}: {}\n".format(name, extract_info(arg))
-    if kwarg_info == "":
-        kwarg_info = "No keyword arguments"
+    def __str__(self):
+        # both the console and the file handler format it
+        if self.text is None:
+            self.text = self.render()
+        return self.text
 
-    lines.append("======================Exception======================")
-    lines.append(f"{str(exception)} ({type(exception)})")
+    def render(self):
+        lines = [
+            "\n===========================================EXCEPTION CAUGHT, DUMPING ALL AVAILABLE INFO===========================================",
+            f"Type: {self.exception_type}"
+        ]
 
-    lines.append("======================ARG INFO======================")
-    lines.append(arg_info)
+        arg_info = "".join(f"{arg}\n" for arg in self.args)
+        if arg_info == "":
+            arg_info = "No arguments"
 
-    lines.append("======================KWARG INFO======================")
-    lines.append(kwarg_info)
+        kwarg_info = "".join(f"{name}: {arg}\n" for name, arg in self.kwargs.items())
+        if kwarg_info == "":
+            kwarg_info = "No keyword arguments"
 
-    lines.append("======================STACKTRACE======================")
-    tb = "".join(traceback.format_tb(exception.__traceback__))
-    lines.append(tb)
+        lines.append("======================Exception======================")
+        lines.append(f"{str(self.exception)} ({type(self.exception)})")
+
+        lines.append("======================ARG INFO======================")
+        lines.append(arg_info)
+
+        lines.append("======================KWARG INFO======================")
+        lines.append(kwarg_info)
+
+        lines.append("======================STACKTRACE======================")
+        lines.append("".join(traceback.format_tb(self.exception.__traceback__)))
+
+        if self.content is not None:
+            lines.append("======================ORIGINAL MESSAGE======================")
+            lines.append(self.content)
+
+            lines.append("======================ORIGINAL MESSAGE (DETAILED)======================")
+            lines.append(str(self.message))
+
+        if self.event is not None:
+            lines.append("======================EVENT NAME======================")
+            lines.append(self.event)
 
+        if self.command is not None:
+            lines.append("======================COMMAND INFO======================")
+            lines.append(f"Command: {self.command[0]}")
+            lines.append(f"Channel: {self.command[1]}")
+            lines.append(f"Sender: {self.command[2]}")
+
+        lines.append(
+            "===========================================DATA DUMP COMPLETE===========================================")
+        return "\n".join(lines)
+
+
+def channel_name(channel):
+    return 'Private Message' if isinstance(channel, PrivateChannel) else f"{channel.name} (`{channel.id}`)"
+
+
+# signature -> [times seen since it was last reported, embed of the first occurrence]
+ERRORS = dict()
+
+
+def signature(exception_type, exception):
+    frames = traceback.extract_tb(exception.__traceback__)
+    origin = f"{frames[-1].filename}:{frames[-1].lineno}" if len(frames) > 0 else ""
+    return exception_type, type(exception).__name__, origin
+
+
+async def handle_exception(exception_type, bot, exception, event=None, message=None, ctx=None, *args, **kwargs):
     if message is None and event is not None and hasattr(event, "message"):
         message = event.message
 
     if message is None and ctx is not None:
         message = ctx.message
 
+    # something went wrong and it might have been in on_command_error, make sure we log to the log file first
+    Logging.LOGGER.error(ExceptionDump(exception_type, exception, event, message, ctx, args, kwargs))
+
+    for t in [ConnectionClosed, ClientOSError, ServerDisconnectedError]:
+        if isinstance(exception, t):
+            return
+
+    # during outages the same error tends to hit everything, only the first one gets posted right away, repeats go
+    # into the next digest
+    key = signature(exception_type, exception)
+    if key in ERRORS:
+        ERRORS[key][0] += 1
+        return
+
+    # nice embed for info on discord
+    embed = Embed(colour=Colour(0xff0000), timestamp=datetime.utcfromtimestamp(time.time()))
     if message is not None and hasattr(message, "content"):
-        lines.append("======================ORIGINAL MESSAGE======================")
-        lines.append(message.content)
         if message.content is None or message.content == "":
             content = "<no content>"
         else:
             content = message.content
         embed.add_field(name="Original message", value=trim_message(content, 1000), inline=False)
 
-        lines.append("======================ORIGINAL MESSAGE (DETAILED)======================")
-        lines.append(extract_info(message))
-
     if event is not None:
-        lines.append("======================EVENT NAME======================")
-        lines.append(event)
         embed.add_field(name="Event", value=event)
 
     if ctx is not None:
-        lines.append("======================COMMAND INFO======================")
-
-        lines.append(f"Command: {ctx.command.name}")
         embed.add_field(name="Command", value=ctx.command.name)
-
-        channel_name = 'Private Message' if isinstance(ctx.channel,
-                                                       PrivateChannel) else f"{ctx.channel.name} (`{ctx.channel.id}`)"
-        lines.append(f"Channel: {channel_name}")
-        embed.add_field(name="Channel", value=channel_name, inline=False)
-
-        sender = f"{str(ctx.author)} (`{ctx.author.id}`)"
-        lines.append(f"Sender: {sender}")
-        embed.add_field(name="Sender", value=sender, inline=False)
-
-    lines.append(
-        "===========================================DATA DUMP COMPLETE===========================================")
-    Logging.error("\n".join(lines))
-
-    for t in [ConnectionClosed, ClientOSError, ServerDisconnectedError]:
-        if isinstance(exception, t):
-            return
-    # nice embed for info on discord
+        embed.add_field(name="Channel", value=channel_name(ctx.channel), inline=False)
+        embed.add_field(name="Sender", value=f"{str(ctx.author)} (`{ctx.author.id}`)", inline=False)
 
     embed.set_author(name=exception_type)
     embed.add_field(name="Exception", value=f"{str(exception)} (`{type(exception)}`)", inline=False)
+    tb = "".join(traceback.format_tb(exception.__traceback__))
     if len(tb) < 1024:
         embed.add_field(name="Traceback", value=tb)
     else:
         embed.add_field(name="Traceback", value="stacktrace too long, see logs")
 
+    ERRORS[key] = [0, embed]
     try:
-        await Logging.bot_log(embed=embed)
+        if await Logging.bot_log(embed=embed, wait=False) is None:
+            # out of room in the rate limit, let the digest deliver it
+            ERRORS[key][0] = 1
     except Exception as ex:
         Logging.error(
             f"Failed to log to botlog, either Discord broke or something is seriously wrong!\n{ex}")
         Logging.error(traceback.format_exc())
 
 
+async def report_errors():
+    while True:
+        await asyncio.sleep(Configuration.CONFIG.error_digest_minutes * 60)
+        errors = list(ERRORS.values())
+        ERRORS.clear()
+        for count, embed in errors:
+            if count == 0:
+                continue
+            embed.description = f"Happened {count} more time{'s' if count > 1 else ''} since it was first reported"
+            try:
+                await Logging.bot_log(embed=embed)
+            except Exception as ex:
+                Logging.error(f"Failed to send error digest to botlog\n{ex}")
+
+
 def trim_message(message, limit):
     if len(message) < limit - 3:
         return message
@@ -139,15 +203,41 @@ def escape_markdown(text):
 def with_role_ping():
     def wrapper(func):
         @wraps(func)
-        async def wrapped(self, *args, **kwargs):
-            channel = self.bot.get_channel(Configuration.get_var("announcement_channel"))
-            role = channel.guild.get_role(Configuration.get_var("tester_role"))
+        async def wrapped(self, ctx, *args, **kwargs):
+            config = Guilds.get(ctx.guild.id) if ctx.guild is not None else None
+            if config is None:
+                # nothing to ping, the command itself tells them the server isn't set up
+                await func(self, ctx, *args, **kwargs)
+                return
+            _, role = Guilds.resolve(ctx.bot, config)
             await role.edit(mentionable=True)
             # wrap everything so we always make the role unmentionable in all cases
             try:
-                await func(self, *args, **kwargs)
+                await func(self, ctx, *args, **kwargs)
             finally:
                 await role.edit(mentionable=False)
 
         return wrapped
     return wrapper
+
+
+async def attachment_lines(attachment):
+    # stream the attachment from discord instead of loading it all into memory, skipping blank lines
+    async with aiohttp.ClientSession() as session:
+        async with session.get(attachment.url) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                line = line.decode().strip()
+                if line != "":
+                    yield line
+
+
+async def batched(iterator, size):
+    batch = list()
+    async for item in iterator:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = list()
+    if len(batch) > 0:
+        yield batch